@@ -0,0 +1,198 @@
+"""
+Benchmark the alignment kernels on synthetic observed/expected pairs
+
+For each size and kind of error, times edit_dist with every engine and mode,
+_score_observed_output and HTMLRenderer._build_comparison_strings,
+recording wall time and peak memory (via tracemalloc, which NumPy reports to).
+The scaling exponent of each curve (the slope of log time over log size) is fit
+at the end, so a jump from ~1 to ~2 flags a kernel that has gone quadratic.
+
+    python benchmarks/alignment_benchmark.py --sizes 1000 4000 16000 -o report.json
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import string
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+
+from byu_pytest_utils.dialog import GAP, _score_observed_output  # nopep8
+from byu_pytest_utils.edit_dist import edit_dist, np  # nopep8
+from byu_pytest_utils.html.html_renderer import HTMLRenderer  # nopep8
+
+CASES = ('exact', 'typos', 'insertion', 'garbage')
+DEFAULT_SIZES = (1_000, 2_000, 4_000, 8_000)
+
+# The python engine builds a dict for every cell, so it is only timed on small inputs
+PYTHON_ENGINE_MAX_SIZE = 1_000
+
+ALPHABET = string.ascii_letters + string.digits + ' .,:'
+
+
+def _random_text(rng: random.Random, size: int) -> str:
+    # Lines of 20 to 60 characters, like a program transcript
+    lines = []
+    length = 0
+    while length < size:
+        line = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(20, 60))) + '\n'
+        lines.append(line)
+        length += len(line)
+    return ''.join(lines)[:size]
+
+
+def make_pair(case: str, size: int, seed: int = 0) -> tuple[str, str]:
+    """A synthetic (observed, expected) pair of about `size` characters each"""
+    rng = random.Random(f'{case}-{size}-{seed}')
+    expected = _random_text(rng, size)
+
+    if case == 'exact':
+        observed = expected
+    elif case == 'typos':
+        # About 1% of the characters substituted, deleted or inserted
+        chars = list(expected)
+        for _ in range(max(1, size // 100)):
+            i = rng.randrange(len(chars))
+            edit = rng.choice('sdi')
+            if edit == 's':
+                chars[i] = rng.choice(ALPHABET)
+            elif edit == 'd':
+                del chars[i]
+            else:
+                chars.insert(i, rng.choice(ALPHABET))
+        observed = ''.join(chars)
+    elif case == 'insertion':
+        # A quarter of the size inserted in the middle (e.g. leftover debug output)
+        middle = len(expected) // 2
+        observed = expected[:middle] + _random_text(rng, size // 4) + expected[middle:]
+    elif case == 'garbage':
+        observed = _random_text(rng, size)
+    else:
+        raise ValueError(f'Unknown case {case!r}; expected one of {CASES}')
+
+    return observed, expected
+
+
+def _targets(observed: str, expected: str):
+    # (target, engine, mode, function) for everything that is benchmarked on this pair
+    size = max(len(observed), len(expected))
+    if size <= PYTHON_ENGINE_MAX_SIZE:
+        yield 'edit_dist', 'python', 'full', lambda: edit_dist(observed, expected, engine='python', anchor=False)
+    if np is not None:
+        for mode in ('full', 'banded', 'hirschberg'):
+            yield 'edit_dist', 'numpy', mode, \
+                lambda mode=mode: edit_dist(observed, expected, engine='numpy', mode=mode, anchor=False)
+        yield 'edit_dist', 'numpy', 'anchored', lambda: edit_dist(observed, expected, engine='numpy')
+        yield 'edit_dist', 'numpy', 'score_only', \
+            lambda: edit_dist(observed, expected, engine='numpy', score_only=True, anchor=False)
+
+    yield '_score_observed_output', None, None, lambda: _score_observed_output(expected, observed)
+
+    _, obs_aligned, exp_aligned = edit_dist(observed, expected)
+    yield '_build_comparison_strings', None, None, \
+        lambda: HTMLRenderer._build_comparison_strings(obs_aligned, exp_aligned, GAP)
+
+
+def _measure(func, repeat: int) -> tuple[float, int]:
+    # Best wall time of `repeat` runs, then peak memory of one more (tracing slows it down)
+    seconds = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def _scaling_exponent(points: list[tuple[int, float]]):
+    # Least-squares slope of log(seconds) over log(size)
+    points = [(math.log(size), math.log(seconds)) for size, seconds in points if seconds > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if spread == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, cases=CASES, repeat: int = 3, verbose: bool = True) -> dict:
+    results = []
+    for case in cases:
+        for size in sizes:
+            observed, expected = make_pair(case, size)
+            for target, engine, mode, func in _targets(observed, expected):
+                seconds, peak = _measure(func, repeat)
+                result = {
+                    'target': target,
+                    'engine': engine,
+                    'mode': mode,
+                    'case': case,
+                    'size': size,
+                    'seconds': seconds,
+                    'peak_bytes': peak,
+                }
+                results.append(result)
+                if verbose:
+                    print(f"{target:<26} {engine or '':<7} {mode or '':<11} {case:<10} {size:>8} "
+                          f"{seconds * 1000:>10.2f} ms {peak / 2 ** 20:>9.2f} MiB")
+
+    curves = {}
+    for result in results:
+        key = (result['target'], result['engine'], result['mode'], result['case'])
+        curves.setdefault(key, []).append((result['size'], result['seconds']))
+    scaling = [
+        {
+            'target': target,
+            'engine': engine,
+            'mode': mode,
+            'case': case,
+            'exponent': _scaling_exponent(points),
+        }
+        for (target, engine, mode, case), points in curves.items()
+    ]
+
+    return {
+        'meta': {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__ if np is not None else None,
+            'platform': platform.platform(),
+            'sizes': list(sizes),
+            'repeat': repeat,
+        },
+        'results': results,
+        'scaling': scaling,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the alignment kernels')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='Approximate lengths (in characters) of the generated pairs')
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES),
+                        help='Kinds of differences between observed and expected')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per measurement (the fastest is kept)')
+    parser.add_argument('-o', '--output', type=Path,
+                        help='Write the JSON report here (default: standard output)')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.cases, args.repeat, verbose=args.output is not None)
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
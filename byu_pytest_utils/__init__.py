@@ -8,7 +8,7 @@ pytest.register_assert_rewrite("byu_pytest_utils.dialog")
 from .utils import run_python_script, with_import, ensure_missing  # nopep8
 from .cpp_utils import compile_cpp, diff_outputs, format_results_for_gradescope  # nopep8
 from .decorators import max_score, visibility, tags, cache  # nopep8
-from .dialog import run_script, run_exec
+from .dialog import run_script, run_exec, score_outputs, run_script_async, run_exec_async, run_many
 
 # Deprecated
 from .dialog import dialog, dialog_exec  # nopep8
@@ -1,22 +1,94 @@
 import argparse
 import asyncio
+import codecs
+import copy
+import errno
+import hashlib
+import mmap
+import os
 import re
 import runpy
 import subprocess as sp
 import sys
+import threading
+import time
 import traceback
 import warnings
 from collections import defaultdict
-from functools import wraps
+from collections.abc import MutableMapping
+from dataclasses import asdict, dataclass
+from functools import lru_cache, partial, wraps
+from itertools import chain, groupby
 from pathlib import Path
 from typing import Union
 
-from byu_pytest_utils.edit_dist import edit_dist
+from byu_pytest_utils.edit_dist import AlignmentTimeout, EditScript, alignment_settings, best_alternative, \
+    check_deadline, common_prefix_length, edit_script, extend_runs, np, pattern_edit_script, token_ids, token_runs, \
+    tokenize, unique_line_anchors
+from byu_pytest_utils.process_state import stdin_waiter
+from byu_pytest_utils.score_cache import score_cache
 
 DEFAULT_GROUP = '.'
 DEFAULT_GROUP_NAME = 'everything-else'
 MAX_PARTIAL_CREDIT = 1
 GAP = '~'
+# When the text itself contains GAP, gaps are shown with the first of these
+# (or else of the private-use characters) that appears in neither text
+GAP_ALTERNATIVES = ('\u2591', '\u00b7', '\u2423')
+
+# Up to this many alignment cells (observed x expected characters) use the banded
+# mode, which is fast for nearly-correct output and falls back to a full matrix.
+# Above it use the linear-memory hirschberg mode instead.
+ALIGNMENT_CELL_LIMIT = 25_000_000
+
+# Transcripts longer than this many characters are first aligned line by line,
+# and only the blocks of mismatched lines are aligned character by character
+LINE_ALIGNMENT_THRESHOLD = 2_000
+
+# Seconds each comparison may spend aligning before falling back to a cheaper
+# approximation (see _budgeted_alignment)
+ALIGNMENT_TIME_BUDGET = 10
+
+# Band (in diagonals) of the approximate banded alignment
+DEGRADED_MAX_BAND = 64
+
+# Output is compared character by character, or whitespace-separated token by token
+# A dialog file can choose with a first line of `#!chars` or `#!tokens`
+GRANULARITIES = ('chars', 'tokens')
+
+# Expected files are first compared with the output file this many bytes at a time
+FILE_COMPARE_CHUNK = 1024 * 1024
+
+# Patterns in a dialog match variable output, such as timestamps or random values:
+#   {{re:REGEX}} matches the regular expression
+#   {{num:VALUE}} or {{num:VALUE+-TOLERANCE}} matches a number close enough to VALUE
+# Each one matches a span of any length as a single alignment step. This needs numpy
+# (the `fast` extra); without it, scoring a dialog with patterns raises ImportError.
+# When the patterns cannot be aligned within the time budget or cell limit, they are
+# compared as literal text and the result is marked as a 'literal' alignment.
+# Inside a ``group``, a pattern cannot contain ';'. A pattern ends at the last of a run
+# of closing braces (so {{re:\d{4}}} is \d{4}), and its braces must balance (escape with \{)
+PATTERN_SYNTAX = re.compile(r'\{\{(re|num):(.*?\}*)\}\}', re.DOTALL)
+# A whole number: not the tail of a longer one (e.g. the 5 of 15, 105 or -5), nor its head
+NUMBER_REGEX = r'(?<![\d.+-])[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?(?![\d.])'
+
+# Markup in a dialog file: <<input>> is typed by the user (and echoed in the output),
+# and ``text;group-name;weight`` is output scored as its own group
+INPUT_MARKUP = re.compile(r'<<(.*?)>>', re.DOTALL)
+GROUP_MARKUP = re.compile(r'``(?P<text>.*?);(?P<name>.+?);(?P<weight>\d+?)``', re.DOTALL)
+DIALOG_MARKUP = re.compile(r'<<(?P<input>.*?)>>|' + GROUP_MARKUP.pattern, re.DOTALL)
+GRANULARITY_DIRECTIVE = re.compile(r'#!(chars|tokens)\r?\n')
+
+# run_exec reads the program's output up to this many bytes at a time
+READ_CHUNK_SIZE = 64 * 1024
+
+# With pty=True, run_exec can send lines of at most this many bytes (with the newline):
+# the size of Linux's line buffer (POSIX only promises MAX_CANON)
+PTY_MAX_LINE = 4096
+
+# While the program is quiet, run_exec checks this often (in seconds) whether it is
+# blocked reading its stdin, so the next input can be sent without waiting out read_timeout
+STDIN_POLL_INTERVAL = 0.005
 
 PS = Union[Path, str]
 
@@ -29,6 +101,9 @@ def _make_group_stats_decorator(group_stats):
             group_stat = group_stats[group_name]
             if not group_stat['passed']:
                 assert group_stat['observed'] == group_stat['expected']
+                # The shown text can look the same (e.g. a difference in trailing spaces)
+                raise AssertionError(
+                    f"{group_name} did not pass: {group_stat['score']} of {group_stat['max_score']}")
         new_func._group_stats = group_stats
         new_func.__name__ = func.__name__
         new_func.__module__ = func.__module__
@@ -44,155 +119,765 @@ def _ensure_absent(output_file):
         output_file.unlink(missing_ok=True)
 
 
-def _extract_input(dialog_contents: str):
-    # Find all tokens delimited by << and >> and return them
-    # as a list along with the original contents with the << and >> removed
-    inputs = re.findall(r'<<(.*?)>>', dialog_contents, re.DOTALL)
-    dialog_contents = re.sub(
-        r'<<(.*?)>>', r'\1', dialog_contents, flags=re.DOTALL)
-    return inputs, dialog_contents
-
+@dataclass(frozen=True)
+class CompiledDialog:
+    """
+    A dialog file parsed once: the inputs to type and the expected output with
+    the markup removed, where group_sequence[i] is the group of expected[i]
+    """
+    inputs: tuple[str, ...]
+    expected: str
+    group_sequence: str
+    group_weights: dict[str, int]
+    group_names: dict[str, str]
+    granularity: str = None
 
-def _extract_groups(dialog_contents: str):
-    # blah blah [[foo;name;10]] blah blah
 
+def _compile_dialog(dialog_contents: str, with_inputs: bool = True) -> CompiledDialog:
+    # blah blah <<input>> blah ``foo;name;10`` blah blah
+    #
+    # A single scan over the markup. Text outside a group belongs to the DEFAULT_GROUP,
+    # and each group gets the next letter of the alphabet, e.g.
+    # quux ``foo;test-foo;30`` bar ``baz;test-baz;20`` quux
+    # produces groups: .....aaa.....bbb.....
+    # and group_weights: {'.': 50, 'a': 30, 'b': 20}
+    # Without `with_inputs` (e.g. for expected files), << and >> are plain text.
+    granularity = None
+    position = 0
+    directive = GRANULARITY_DIRECTIVE.match(dialog_contents)
+    if directive is not None:
+        granularity = directive.group(1)
+        position = directive.end()
+
+    inputs = []
+    expected = []
+    group_sequence = []
     group_weights = {DEFAULT_GROUP: 0}
-    group_names = {
-        DEFAULT_GROUP: DEFAULT_GROUP_NAME
-    }
+    group_names = {DEFAULT_GROUP: DEFAULT_GROUP_NAME}
+
+    markup = DIALOG_MARKUP if with_inputs else GROUP_MARKUP
+    for match in markup.finditer(dialog_contents, position):
+        text = dialog_contents[position:match.start()]
+        position = match.end()
+        expected.append(text)
+        group_sequence.append(DEFAULT_GROUP * len(text))
+
+        if with_inputs and match.group('input') is not None:
+            inputs.append(match.group('input'))
+            expected.append(match.group('input'))
+            group_sequence.append(DEFAULT_GROUP * len(match.group('input')))
+            continue
+
+        group_symbol = chr(ord('a') - 1 + len(group_weights))
+        group_names[group_symbol] = match.group('name')
+        group_weights[group_symbol] = int(match.group('weight'))
+        text = match.group('text')
+        if with_inputs:
+            # Inputs typed inside a group
+            inputs.extend(INPUT_MARKUP.findall(text))
+            text = INPUT_MARKUP.sub(r'\1', text)
+        expected.append(text)
+        group_sequence.append(group_symbol * len(text))
+
+    text = dialog_contents[position:]
+    expected.append(text)
+    group_sequence.append(DEFAULT_GROUP * len(text))
 
-    group_sequence = ''
-
-    # Iterate through the dialog contents
-    # Characters not in a group are assigned to weight group 'a'
-    # Each weight group is assigned the next letter of the alphabet
-    # A group starts with [[ and ends with ]]
-    # The semicolon separates the group text from the weight
-    # All text in a group is assigned to the same weight group
-    # e.g.
-    # quux [[foo;test-foo;30]] bar [[baz;test-baz;20]] quux
-    # produces groups: aaaaabbbaaaacccaaaa
-    # and group_weights: {'-': 40, 'b': 30, 'c': 20}
-
-    i = 0
-    while i < len(dialog_contents):
-        if dialog_contents[i:i + 2] == '``':
-            # Start of a group
-            group_symbol = chr(ord('a') - 1 + len(group_weights))
-            group_match = re.search(
-                r'``(.*?);(.+?);(\d+?)``', dialog_contents[i:], flags=re.DOTALL)
-            group_text = group_match.group(1)
-            group_name = group_match.group(2)
-            group_names[group_symbol] = group_name
-            group_weights[group_symbol] = int(group_match.group(3))
-            group_sequence += group_symbol * len(group_text)
-            i += group_match.end()
-        else:
-            # Not in a group
-            group_sequence += DEFAULT_GROUP
-            i += 1
     total = sum(group_weights.values())
     if total > 100:
         raise Exception('Group weights must add up to 100 or less')
     group_weights[DEFAULT_GROUP] = 100 - total
 
-    # Then remove the groups from the dialog contents
-    dialog_contents = re.sub(
-        r'``(.*?);(.+?);(\d+?)``', r'\1', dialog_contents, flags=re.DOTALL)
+    return CompiledDialog(
+        tuple(inputs), ''.join(expected), ''.join(group_sequence), group_weights, group_names, granularity
+    )
+
+
+@lru_cache(maxsize=256)
+def _compile_dialog_text(dialog_contents: str, with_inputs: bool = False) -> CompiledDialog:
+    return _compile_dialog(dialog_contents, with_inputs)
+
+
+@lru_cache(maxsize=256)
+def _compile_dialog_version(path: str, mtime_ns: int, size: int, with_inputs: bool) -> CompiledDialog:
+    # A file is only parsed again once it changes, in this process or (with the
+    # score cache configured) in any later one
+    cache = score_cache()
+    if cache is not None:
+        key = cache.key('dialog', path, mtime_ns, size, with_inputs)
+        cached = cache.get(key)
+        if cached is not None:
+            return CompiledDialog(**{**cached, 'inputs': tuple(cached['inputs'])})
+
+    dialog = _compile_dialog(Path(path).read_text(), with_inputs)
+    if cache is not None:
+        cache.put(key, asdict(dialog))
+    return dialog
+
+
+def _load_dialog(dialog_file: Path, with_inputs: bool = True) -> CompiledDialog:
+    stat = dialog_file.stat()
+    return _compile_dialog_version(str(dialog_file.absolute()), stat.st_mtime_ns, stat.st_size, with_inputs)
+
+
+def _as_dialog(expected_output: Union[str, CompiledDialog]) -> CompiledDialog:
+    # Expected output given as text has no inputs in it
+    if isinstance(expected_output, CompiledDialog):
+        return expected_output
+    return _compile_dialog_text(expected_output)
+
+
+def _extract_alternative_inputs(dialog_files: list[Path]):
+    # Return the inputs shared by all the accepted dialogs
+    # (the program only runs once) and each compiled dialog
+    dialogs = [_load_dialog(dialog_file) for dialog_file in dialog_files]
+    for dialog_file, dialog in zip(dialog_files, dialogs):
+        if dialog.inputs != dialogs[0].inputs:
+            raise ValueError(f'{dialog_file} does not give the same inputs as {dialog_files[0]}')
+    return list(dialogs[0].inputs), dialogs
+
+
+@dataclass(frozen=True)
+class DialogPattern:
+    placeholder: str  # The pattern as written in the dialog
+    regex: re.Pattern
+    value: float = None
+    tolerance: float = 0
+
+    def spans(self, observed: str) -> list[tuple[int, int]]:
+        # The longest match starting at each position
+        spans = []
+        for start in range(len(observed) + 1):
+            match = self.regex.match(observed, start)
+            if match is None:
+                continue
+            if self.value is not None and abs(float(match.group()) - self.value) > self.tolerance:
+                continue
+            spans.append((start, match.end()))
+        return spans
+
+
+@lru_cache(maxsize=None)
+def _compile_pattern(placeholder: str) -> DialogPattern:
+    kind, spec = PATTERN_SYNTAX.fullmatch(placeholder).groups()
+    if kind == 're':
+        # re reads an unclosed { as text, which would hide a pattern that was cut short
+        braces = re.sub(r'\\.', '', spec)
+        if braces.count('{') != braces.count('}'):
+            raise ValueError(f'The braces of dialog pattern {placeholder} do not balance')
+        try:
+            return DialogPattern(placeholder, re.compile(spec))
+        except re.error as error:
+            raise ValueError(f'Dialog pattern {placeholder} is not a valid regular expression: {error}') from error
+    value, _, tolerance = spec.partition('+-')
+    try:
+        return DialogPattern(placeholder, re.compile(NUMBER_REGEX), float(value), float(tolerance or 0))
+    except ValueError as error:
+        raise ValueError(f'Dialog pattern {placeholder} is not VALUE or VALUE+-TOLERANCE') from error
 
-    return group_weights, group_names, group_sequence, dialog_contents
 
+def _alignment_mode(cells, cell_limit):
+    if np is None:
+        return 'full'
+    return 'hirschberg' if cells > cell_limit else 'banded'
 
-def _score_observed_output(expected_output, observed_output):
-    group_weights, group_names, group_sequence, dialog_contents = _extract_groups(expected_output)
 
-    _, obs, exp = edit_dist(
-        observed_output,
-        dialog_contents,
-        GAP=GAP
+def _align_chars(observed, expected, cell_limit, deadline=None):
+    cells = (len(observed) + 1) * (len(expected) + 1)
+    _, script = edit_script(
+        observed,
+        expected,
+        mode=_alignment_mode(cells, cell_limit),
+        deadline=deadline
+    )
+    return script
+
+
+def _align_banded(observed, expected, cell_limit, deadline=None):
+    # A narrow fixed band: fast, but not always the best alignment
+    n, m = len(observed), len(expected)
+    if (m + 1) * (min(n, abs(n - m) + 2 * DEGRADED_MAX_BAND) + 1) > cell_limit:
+        return None
+    _, script = edit_script(
+        observed,
+        expected,
+        mode='banded',
+        max_band=DEGRADED_MAX_BAND,
+        deadline=deadline
     )
+    return script
+
+
+def _unaligned(observed, expected):
+    # Line up the two blocks character by character, without looking for matches
+    common = min(len(observed), len(expected))
+    runs = [('X', common), ('I', len(observed) - common), ('D', len(expected) - common)]
+    return EditScript(observed, expected, [(op, length) for op, length in runs if length])
+
+
+def _align_prefix(observed, expected):
+    prefix = common_prefix_length(observed, expected)
+    runs = extend_runs([('=', prefix)], _unaligned(observed[prefix:], expected[prefix:]).runs)
+    return EditScript(observed, expected, runs)
+
+
+def _match_lines(obs_lines, exp_lines, deadline=None) -> list[tuple[int, int, int]]:
+    # Patience matching of identical lines: the common leading and trailing lines
+    # of a region match, then the lines that occur once on each side anchor the
+    # match, and the regions between the anchors are matched the same way.
+    # Returns (observed line, expected line, count) blocks in order, ending with an
+    # empty block at the end of both (like difflib's get_matching_blocks).
+    ids = {}
+    obs_ids = [ids.setdefault(line, len(ids)) for line in obs_lines]
+    exp_ids = [ids.setdefault(line, len(ids)) for line in exp_lines]
+
+    matched = []
+    regions = [(0, len(obs_ids), 0, len(exp_ids))]
+    while regions:
+        check_deadline(deadline)
+        o_start, o_end, e_start, e_end = regions.pop()
+        while o_start < o_end and e_start < e_end and obs_ids[o_start] == exp_ids[e_start]:
+            matched.append((o_start, e_start))
+            o_start += 1
+            e_start += 1
+        while o_start < o_end and e_start < e_end and obs_ids[o_end - 1] == exp_ids[e_end - 1]:
+            o_end -= 1
+            e_end -= 1
+            matched.append((o_end, e_end))
+        if o_start == o_end or e_start == e_end:
+            continue
+
+        anchors = unique_line_anchors(obs_ids[o_start:o_end], exp_ids[e_start:e_end])
+        if not anchors:
+            continue  # No line matches in between
+        o, e = o_start, e_start
+        for o_anchor, e_anchor in anchors:
+            o_anchor += o_start
+            e_anchor += e_start
+            matched.append((o_anchor, e_anchor))
+            regions.append((o, o_anchor, e, e_anchor))
+            o, e = o_anchor + 1, e_anchor + 1
+        regions.append((o, o_end, e, e_end))
+
+    # Join the matched lines into blocks
+    blocks = []
+    for o, e in sorted(matched):
+        if blocks and blocks[-1][0] + blocks[-1][2] == o and blocks[-1][1] + blocks[-1][2] == e:
+            blocks[-1][2] += 1
+        else:
+            blocks.append([o, e, 1])
+    return [tuple(block) for block in blocks] + [(len(obs_ids), len(exp_ids), 0)]
+
+
+def _line_matching(observed, expected, deadline=None):
+    obs_lines = observed.splitlines(keepends=True)
+    exp_lines = expected.splitlines(keepends=True)
+    return obs_lines, exp_lines, _match_lines(obs_lines, exp_lines, deadline)
+
+
+def _align_lines(observed, expected, align_block, matching=None, deadline=None):
+    # Match identical lines (by hash) first; runs of matching lines
+    # are kept as whole blocks and only the lines between them
+    # are aligned by align_block
+    obs_lines, exp_lines, blocks = matching or _line_matching(observed, expected, deadline)
+
+    runs = []
+    o = 0
+    e = 0
+    for o_start, e_start, size in blocks:
+        obs_block = ''.join(obs_lines[o:o_start])
+        exp_block = ''.join(exp_lines[e:e_start])
+        if obs_block or exp_block:
+            extend_runs(runs, align_block(obs_block, exp_block).runs)
+
+        matched = sum(len(line) for line in obs_lines[o_start:o_start + size])
+        extend_runs(runs, [('=', matched)])
+        o = o_start + size
+        e = e_start + size
+
+    return EditScript(observed, expected, runs)
+
+
+def _align_output(observed, expected, cell_limit=ALIGNMENT_CELL_LIMIT, deadline=None,
+                  match_lines=_line_matching) -> EditScript:
+    if observed == expected:
+        # There is nothing to align
+        return EditScript(observed, expected, [('=', len(expected))] if expected else [])
+    if len(observed) + len(expected) > LINE_ALIGNMENT_THRESHOLD:
+        return _align_lines(observed, expected,
+                            partial(_align_chars, cell_limit=cell_limit, deadline=deadline),
+                            match_lines(observed, expected, deadline))
+    return _align_chars(observed, expected, cell_limit, deadline)
+
+
+def _budgeted_alignment(observed, expected, cell_limit=ALIGNMENT_CELL_LIMIT,
+                        time_budget=ALIGNMENT_TIME_BUDGET) -> tuple[EditScript, str]:
+    """
+    Align observed against expected, degrading the alignment to stay within budget
+
+    The steps of the ladder are tried in order, each with half of the remaining time:
+    'full' (the usual alignment), 'banded' (a narrow fixed band),
+    'lines' (only identical lines are matched) and 'prefix' (only the common prefix
+    is matched), which takes linear time and always finishes.
+    Pointer memory is kept within `cell_limit` cells throughout.
+
+    :return: the edit script and the step of the ladder that produced it
+    """
+    matchings = []  # The line matching, shared by the 'full' and 'lines' steps
+
+    def match_lines(observed, expected, deadline):
+        if not matchings:
+            matchings.append(_line_matching(observed, expected, deadline))
+        return matchings[0]
+
+    steps = [
+        ('full', lambda deadline: _align_output(observed, expected, cell_limit, deadline, match_lines)),
+        ('banded', lambda deadline: _align_banded(observed, expected, cell_limit, deadline)),
+        ('lines', lambda deadline: _align_lines(observed, expected, _unaligned,
+                                                match_lines(observed, expected, deadline))),
+    ]
+    if np is None:
+        # Banded alignment needs the numpy engine
+        del steps[1]
+
+    start = time.monotonic()
+    for step, align in steps:
+        deadline = None
+        if time_budget is not None:
+            now = time.monotonic()
+            deadline = now + (start + time_budget - now) / 2
+        try:
+            script = align(deadline)
+        except AlignmentTimeout:
+            continue
+        if script is not None:
+            return script, step
+
+    return _align_prefix(observed, expected), 'prefix'
+
+
+def _align_patterns(observed, expected, group_sequence, cell_limit=ALIGNMENT_CELL_LIMIT,
+                    time_budget=ALIGNMENT_TIME_BUDGET):
+    # Split expected into literal text and patterns
+    segments = []
+    last = 0
+    for match in PATTERN_SYNTAX.finditer(expected):
+        segments.append(expected[last:match.start()])
+        segments.append(_compile_pattern(match.group()))
+        last = match.end()
+    segments.append(expected[last:])
+
+    # Pattern alignment fills the full matrix (a row per expected character or pattern,
+    # plus the first row of each segment)
+    rows = sum(len(segment) + 1 if isinstance(segment, str) else 1 for segment in segments) + 1
+    if rows * (len(observed) + 1) > cell_limit:
+        return None  # Compare the patterns as literal text instead
+
+    deadline = time.monotonic() + time_budget if time_budget is not None else None
+    try:
+        _, script, matches = pattern_edit_script(observed, segments, deadline=deadline)
+    except AlignmentTimeout:
+        return None  # Compare the patterns as literal text instead
+
+    # Each pattern is replaced by the text it matched, which belongs to the pattern's group
+    sequence = []
+    position = 0
+    spans = iter(matches)
+    for segment in segments:
+        if isinstance(segment, str):
+            sequence.append(group_sequence[position:position + len(segment)])
+            position += len(segment)
+        else:
+            span = next(spans)
+            length = span[1] - span[0] if span is not None else len(segment.placeholder)
+            sequence.append(group_sequence[position] * length)
+            position += len(segment.placeholder)
+
+    return script, ''.join(sequence)
 
-    # insert gaps (i.e. DEFAULT_GROUP) into self.groups to match exp
-    # then iterate over obs, exp, and groups
+
+def _align_tokens(observed, expected, cell_limit=ALIGNMENT_CELL_LIMIT,
+                  time_budget=ALIGNMENT_TIME_BUDGET) -> tuple[EditScript, str]:
+    # Align one character per token, then map the runs back onto the characters
+    obs_tokens, exp_tokens = tokenize(observed), tokenize(expected)
+    obs_ids, exp_ids = token_ids(obs_tokens, exp_tokens)
+    script, alignment = _budgeted_alignment(obs_ids, exp_ids, cell_limit, time_budget)
+    return EditScript(observed, expected, token_runs(script, obs_tokens, exp_tokens)), alignment
+
+
+def _aggregate_groups(script: EditScript, group_sequence: str, text: bool = True, gap: str = GAP):
+    # Walk the runs of the edit script alongside the groups of expected
     # to compute rate of matches per group
-    # (a gap in obs counts should use the prior group)
+    # (text only in observed counts against the prior group)
     # and return the score for each group
     # e.g. if groups is '---bbbcccc'
     # and group_weights is {'-': 50, 'b': 20, 'c': 30}
     # and exp is 'foobar~bazz'
     # and obs is 'boobarflaz~'
     # then groups should become '---bbbbcccc'
+    # Without `text`, only the counts are computed (the text lists stay empty)
+    if np is not None:
+        return _aggregate_groups_vectorized(script, group_sequence, text, gap)
+
+    group_counts = defaultdict(int)
+    group_matches = defaultdict(int)
+    group_obs = defaultdict(list)
+    group_exp = defaultdict(list)
+    group_id = DEFAULT_GROUP
+    g = 0
+    for op, obs_text, exp_text in script.segments():
+        if op == 'I':
+            group_counts[group_id] += len(obs_text)
+            if text:
+                group_obs[group_id].append(obs_text)
+                group_exp[group_id].append(gap * len(obs_text))
+            continue
 
-    if len(exp) - exp.count(GAP) != len(group_sequence):
-        raise Exception('Too many gaps in expected output')
+        # Split the run where the group changes
+        start = 0
+        for group_id, members in groupby(group_sequence[g:g + len(exp_text)]):
+            length = sum(1 for _ in members)
+            group_counts[group_id] += length
+            if op == '=':
+                group_matches[group_id] += length
+            if text:
+                group_obs[group_id].append(obs_text[start:start + length] or gap * length)
+                group_exp[group_id].append(exp_text[start:start + length])
+            start += length
+        g += len(exp_text)
+
+    return group_counts, group_matches, group_obs, group_exp
+
+
+def _aggregate_groups_vectorized(script: EditScript, group_sequence: str, text: bool = True, gap: str = GAP):
+    # The same as _aggregate_groups, but the counts are bincounts over the group
+    # of each expected character (its code point), and the text is cut only
+    # where a run or a group ends instead of character by character
+    groups = np.frombuffer(group_sequence.encode('utf-32-le'), dtype=np.uint32).astype(np.intp)
+    ops = np.array([op for op, _ in script.runs], dtype='<U1')
+    lengths = np.array([length for _, length in script.runs], dtype=np.intp)
+    inserted = ops == 'I'
+    exp_lengths = np.where(inserted, 0, lengths)
+    exp_ends = np.cumsum(exp_lengths)
+    exp_starts = exp_ends - exp_lengths
+
+    # Text only in observed belongs to the group of the expected character before it
+    previous = [group_sequence[e - 1] if e else DEFAULT_GROUP for e in exp_starts[inserted].tolist()]
+    size = max(int(groups.max(initial=0)), ord(DEFAULT_GROUP)) + 1
+    counts = np.bincount(groups, minlength=size)
+    np.add.at(counts, np.array([ord(group_id) for group_id in previous], dtype=np.intp), lengths[inserted])
+    matches = np.bincount(groups[np.repeat(ops == '=', exp_lengths)], minlength=size)
+
+    group_counts = defaultdict(int, {chr(c): int(counts[c]) for c in np.flatnonzero(counts)})
+    group_matches = defaultdict(int, {chr(c): int(matches[c]) for c in np.flatnonzero(matches)})
+
+    # The positions in expected where the group changes, and the range of them inside each run
+    changes = (np.flatnonzero(groups[1:] != groups[:-1]) + 1).tolist()
+    first_change = np.searchsorted(changes, exp_starts, side='right').tolist()
+    last_change = np.searchsorted(changes, exp_ends, side='left').tolist()
+
+    group_obs = defaultdict(list)
+    group_exp = defaultdict(list)
+    if not text:
+        return group_counts, group_matches, group_obs, group_exp
+
+    previous = iter(previous)
+    o = 0
+    for (op, length), start, lo, hi in zip(script.runs, exp_starts.tolist(), first_change, last_change):
+        if op == 'I':
+            group_id = next(previous)
+            group_obs[group_id].append(script.observed[o:o + length])
+            group_exp[group_id].append(gap * length)
+            o += length
+            continue
+
+        # Split the run where the group changes
+        cuts = [start, *changes[lo:hi], start + length]
+        for cut, end in zip(cuts, cuts[1:]):
+            group_id = group_sequence[cut]
+            group_exp[group_id].append(script.expected[cut:end])
+            if op == 'D':
+                group_obs[group_id].append(gap * (end - cut))
+            else:
+                group_obs[group_id].append(script.observed[o + cut - start:o + end - start])
+        if op != 'D':
+            o += length
+
+    return group_counts, group_matches, group_obs, group_exp
+
+
+def _pad(text):
+    # Pad with spaces to 80 chars
+    return text + ' ' * (80 - len(text))
+
+
+def _choose_gap(*texts: str) -> str:
+    # A gap character that cannot be mistaken for a character of the text
+    candidates = chain((GAP,), GAP_ALTERNATIVES, map(chr, range(0xF8FF, 0xE000, -1)))
+    return next(gap for gap in candidates if not any(gap in text for text in texts))
+
+
+class _GroupAlignment:
+    """The alignment of one comparison, shared by the stats of all its groups"""
+    __slots__ = ('script', 'group_sequence', 'gap')
+
+    def __init__(self, script: EditScript, group_sequence: str):
+        self.script = script
+        self.group_sequence = group_sequence
+        self.gap = _choose_gap(script.observed, script.expected)
+
+    def text(self, group_id) -> tuple[str, str]:
+        """The (observed, expected) text of a group, built anew on each call"""
+        if group_id == DEFAULT_GROUP:
+            # The default group shows the full output
+            obs, exp = self.script.aligned(self.gap)
+            return _pad(obs), _pad(exp)
+        _, _, group_obs, group_exp = _aggregate_groups(self.script, self.group_sequence, gap=self.gap)
+        return ''.join(group_obs[group_id]), ''.join(group_exp[group_id])
+
+
+class _IdenticalText:
+    """The text of a comparison where observed and expected are the same"""
+    __slots__ = ('content',)
+    gap = GAP  # There are no gaps
+
+    def __init__(self, content: str):
+        self.content = content
+
+    def text(self, group_id) -> tuple[str, str]:
+        return _pad(self.content), _pad(self.content)
+
+
+class _FixedText:
+    """Text that was already built (e.g. read back from the score cache)"""
+    __slots__ = ('observed', 'expected', 'gap')
+
+    def __init__(self, observed: str = '', expected: str = '', gap: str = GAP):
+        self.observed = observed
+        self.expected = expected
+        self.gap = gap
+
+    def text(self, group_id) -> tuple[str, str]:
+        return self.observed, self.expected
 
-    group_ids = ''
-    i = 0
-    g = 0
-    while i < len(exp):
-        if exp[i] == GAP:
-            group_ids += group_ids[-1] if group_ids else DEFAULT_GROUP
-            i += 1
-        else:
-            group_ids += group_sequence[g]
-            g += 1
-            i += 1
-    assert len(group_ids) == len(exp)
-
-    # Compute group scores
-    group_counts = {}
-    group_matches = {}
-    group_obs = {}
-    group_exp = {}
-    for obs_c, exp_c, group_id in zip(obs, exp, group_ids):
-        if obs_c == exp_c:
-            group_matches[group_id] = group_matches.get(group_id, 0) + 1
-        group_counts[group_id] = group_counts.get(group_id, 0) + 1
-        group_obs[group_id] = group_obs.get(group_id, '') + obs_c
-        group_exp[group_id] = group_exp.get(group_id, '') + exp_c
-
-    # Fix default group obs/exp
-    # Use the full output, and pad with spaces to 80 chars
-    def pad(text):
-        return text + ' ' * (80 - len(text))
-
-    group_obs[DEFAULT_GROUP] = pad(
-        obs)
-    group_exp[DEFAULT_GROUP] = pad(
-        exp)
 
+class GroupStats(MutableMapping):
+    """
+    The score of one group, used like the dict of
+    group_name, expected, observed, score, max_score, passed, alignment (and alternative)
+    that it replaces, plus the gap character the text uses. The scores can be changed
+    (the plugin scales them in place); 'observed', 'expected' and 'gap' are read-only,
+    and the text is only built from the shared alignment when it is read,
+    so keeping many results alive does not keep copies of the transcripts.
+    """
+    __slots__ = ('name', 'score', 'max_score', 'passed', 'alignment', 'alternative', 'source', 'group_id')
+
+    # Key -> attribute of the scalar fields
+    _FIELDS = {
+        'group_name': 'name',
+        'score': 'score',
+        'max_score': 'max_score',
+        'passed': 'passed',
+        'alignment': 'alignment',
+        'alternative': 'alternative',
+    }
+    _KEYS = ('group_name', 'expected', 'observed', 'gap', 'score', 'max_score', 'passed', 'alignment',
+             'alternative')
+
+    def __init__(self, name, score, max_score, passed, alignment='full', alternative=None,
+                 source: Union[_GroupAlignment, _IdenticalText, _FixedText] = _FixedText(),
+                 group_id=DEFAULT_GROUP):
+        self.name = name
+        self.score = score
+        self.max_score = max_score
+        self.passed = passed
+        self.alignment = alignment
+        self.alternative = alternative
+        # What builds the text (e.g. the shared alignment)
+        self.source = source
+        self.group_id = group_id
+
+    def __getitem__(self, key):
+        if key == 'observed':
+            return self.source.text(self.group_id)[0]
+        if key == 'expected':
+            return self.source.text(self.group_id)[1]
+        if key == 'gap':
+            return self.source.gap
+        if key not in self._FIELDS or (key == 'alternative' and self.alternative is None):
+            raise KeyError(key)
+        return getattr(self, self._FIELDS[key])
+
+    def __setitem__(self, key, value):
+        if key not in self._FIELDS:
+            raise KeyError(f'{key} cannot be set on {type(self).__name__}')
+        setattr(self, self._FIELDS[key], value)
+
+    def __delitem__(self, key):
+        if key != 'alternative' or self.alternative is None:
+            raise KeyError(key)
+        self.alternative = None
+
+    def __iter__(self):
+        return (key for key in self._KEYS if key != 'alternative' or self.alternative is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __deepcopy__(self, memo):
+        # The alignment is never changed, so copies share it
+        return copy.copy(self)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.name!r}, score={self.score!r}, max_score={self.max_score!r}, ' \
+               f'passed={self.passed!r}, alignment={self.alignment!r})'
+
+
+class DialogStats(GroupStats):
+    """The consolidated stats of stdout or of an expected file; the same, keyed by 'name'"""
+    __slots__ = ()
+
+    _FIELDS = {'name' if key == 'group_name' else key: attribute for key, attribute in GroupStats._FIELDS.items()}
+    _KEYS = tuple('name' if key == 'group_name' else key for key in GroupStats._KEYS)
+
+
+def _score_observed_output(expected_output: Union[str, CompiledDialog], observed_output,
+                           cell_limit=ALIGNMENT_CELL_LIMIT,
+                           time_budget=ALIGNMENT_TIME_BUDGET, granularity=None):
+    dialog = _as_dialog(expected_output)
+    dialog_contents = dialog.expected
+    group_sequence = dialog.group_sequence
+
+    # Identical output for the same dialog (e.g. on a regrade) scores the same
+    cache = score_cache()
+    if cache is not None:
+        key = cache.key(dialog_contents, group_sequence, dialog.group_weights, dialog.group_names,
+                        dialog.granularity, observed_output, granularity,
+                        cell_limit, LINE_ALIGNMENT_THRESHOLD, DEGRADED_MAX_BAND, alignment_settings())
+        cached_stats = cache.get(key)
+        if cached_stats is not None:
+            return cached_stats
+
+    granularity = granularity or dialog.granularity or 'chars'
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'Unknown granularity {granularity!r}; expected one of {GRANULARITIES}')
+
+    patterns = None
+    has_patterns = PATTERN_SYNTAX.search(dialog_contents) is not None
+    if has_patterns:
+        if np is None:
+            raise ImportError('Dialogs with {{re:...}} or {{num:...}} patterns need NumPy '
+                              '(pip install byu_pytest_utils[fast])')
+        patterns = _align_patterns(observed_output, dialog_contents, group_sequence, cell_limit, time_budget)
+
+    if patterns is not None:
+        script, group_sequence = patterns
+        alignment = 'full'
+    elif granularity == 'tokens':
+        script, alignment = _align_tokens(observed_output, dialog_contents, cell_limit, time_budget)
+    else:
+        script, alignment = _budgeted_alignment(observed_output, dialog_contents, cell_limit, time_budget)
+
+    if has_patterns and patterns is None and alignment == 'full':
+        # The patterns were compared as literal text, so correct output can fail
+        alignment = 'literal'
+
+    group_counts, group_matches, _, _ = _aggregate_groups(script, group_sequence, text=False)
+
+    # The text of each group is only built if a report or assertion asks for it
+    source = _GroupAlignment(script, group_sequence)
     group_stats = {}
-    for group_id, group_name in group_names.items():
+    for group_id, group_name in dialog.group_names.items():
         if group_id not in group_counts:
             # For example, the DEFAULT_GROUP sometimes has no hits
             continue
-        group_max = group_weights[group_id] / 100
-        group_stats[group_name] = {
-            'group_name': group_name,
-            'expected': group_exp[group_id],
-            'observed': group_obs[group_id],
-            'score': group_matches.get(group_id, 0) / group_counts[group_id] * group_max,
-            'max_score': group_max,
-            'passed': group_max == 0 or group_matches.get(group_id, -1) == group_counts[group_id],
-        }
+        group_max = dialog.group_weights[group_id] / 100
+        group_stats[group_name] = GroupStats(
+            group_name,
+            score=group_matches[group_id] / group_counts[group_id] * group_max,
+            max_score=group_max,
+            passed=group_max == 0 or group_matches[group_id] == group_counts[group_id],
+            alignment=alignment,
+            source=source,
+            group_id=group_id,
+        )
+
+    if cache is not None and alignment == 'full':
+        # Approximations depend on how busy the machine was, so only exact results are kept
+        cache.put(key, {group_name: dict(stats) for group_name, stats in group_stats.items()})
 
     return group_stats
 
 
-def _consolidate_stats(name, stats):
+def _score_alternatives(expected_outputs, observed_output, granularity=None,
+                        cell_limit=ALIGNMENT_CELL_LIMIT, time_budget=ALIGNMENT_TIME_BUDGET):
+    # Score against whichever accepted dialog the output aligns with best;
+    # choosing may take half of the time budget, and scoring gets what is left
+    dialogs = [_as_dialog(expected) for expected in expected_outputs]
+    start = time.monotonic()
+    deadline = start + time_budget / 2 if time_budget is not None else None
+    best, _ = best_alternative(observed_output, [dialog.expected for dialog in dialogs],
+                               max_cells=cell_limit, deadline=deadline)
+    if time_budget is not None:
+        time_budget = max(0, start + time_budget - time.monotonic())
+    stats = _score_observed_output(dialogs[best], observed_output, cell_limit=cell_limit,
+                                   time_budget=time_budget, granularity=granularity)
+    for group in stats.values():
+        group['alternative'] = best
+    return stats
+
+
+def _files_identical(file1: Path, file2: Path) -> bool:
+    # Compare the sizes, then the bytes a chunk at a time (stopping at the first difference)
+    size = file1.stat().st_size
+    if file2.stat().st_size != size:
+        return False
+    if size == 0:
+        return True
+    with open(file1, 'rb') as f1, open(file2, 'rb') as f2, \
+            mmap.mmap(f1.fileno(), 0, access=mmap.ACCESS_READ) as map1, \
+            mmap.mmap(f2.fileno(), 0, access=mmap.ACCESS_READ) as map2:
+        for start in range(0, size, FILE_COMPARE_CHUNK):
+            if map1[start:start + FILE_COMPARE_CHUNK] != map2[start:start + FILE_COMPARE_CHUNK]:
+                return False
+    return True
+
+
+def _score_identical_file(expected: CompiledDialog):
+    # The stats _score_observed_output gives output that matches plain expected text exactly
     return {
-        'name': name,
-        'expected': stats['everything-else']['expected'],
-        'observed': stats['everything-else']['observed'],
-        'score': round(sum(group['score'] for group in stats.values()), 3),
-        'max_score': round(sum(group['max_score'] for group in stats.values()), 3),
-        'passed': all(group['passed'] for group in stats.values()),
+        DEFAULT_GROUP_NAME: GroupStats(
+            DEFAULT_GROUP_NAME, score=1.0, max_score=1.0, passed=True,
+            source=_IdenticalText(expected.expected)
+        )
     }
 
 
+def _consolidate_stats(name, stats):
+    default = stats['everything-else']
+    if isinstance(default, GroupStats):
+        # Share the alignment rather than copying the transcript
+        source, group_id = default.source, default.group_id
+    else:
+        # Stats read back from the score cache already hold the text
+        source = _FixedText(default['observed'], default['expected'], default.get('gap', GAP))
+        group_id = DEFAULT_GROUP
+    return DialogStats(
+        name,
+        score=round(sum(group['score'] for group in stats.values()), 3),
+        max_score=round(sum(group['max_score'] for group in stats.values()), 3),
+        passed=all(group['passed'] for group in stats.values()),
+        alignment=default['alignment'],
+        alternative=default.get('alternative'),
+        source=source,
+        group_id=group_id,
+    )
+
+
 def _score_output(
-        expected_io: str, observed_io: str,
-        expected_files: list[tuple[Path, Path]]
+        expected_io: Union[str, CompiledDialog, list], observed_io: str,
+        expected_files: list[tuple[Path, Path]],
+        granularity: str = None
 ):
     # ORIGINAL - per-group test results
     # group_stats = { }
@@ -208,47 +893,48 @@ def _score_output(
     # return group_stats
 
     group_stats = {}
-    if expected_io is not None:
-        stats = _score_observed_output(expected_io, observed_io)
+    if isinstance(expected_io, list):
+        stats = _score_alternatives(expected_io, observed_io, granularity)
+        group_stats['stdout'] = _consolidate_stats('stdout', stats)
+    elif expected_io is not None:
+        stats = _score_observed_output(expected_io, observed_io, granularity=granularity)
         group_stats['stdout'] = _consolidate_stats('stdout', stats)
 
     for exp_file, obs_file in expected_files:
+        expected = _load_dialog(exp_file, with_inputs=False)
+        # Markup in the expected file would be part of the bytes, so only plain text can be compared as is
+        plain = len(expected.group_names) == 1 and expected.granularity is None \
+            and not PATTERN_SYNTAX.search(expected.expected)
         if not obs_file.exists():
             obs_content = f'File not found: {obs_file}. Did you write it?\n' + observed_io
+        elif plain and _files_identical(exp_file, obs_file):
+            # Nothing to align (or even decode)
+            group_stats[exp_file.name] = _consolidate_stats(exp_file.name, _score_identical_file(expected))
+            continue
         else:
             obs_content = obs_file.read_text()
-        stats = _score_observed_output(exp_file.read_text(), obs_content)
+        stats = _score_observed_output(expected, obs_content, granularity=granularity)
         group_stats[exp_file.name] = _consolidate_stats(exp_file.name, stats)
 
 
     return group_stats
 
 
-async def _read_stream(stream: asyncio.StreamReader, timeout: float, output_limit: int):
+async def _pump_stream(stream: asyncio.StreamReader, decoder: codecs.IncrementalDecoder, on_text):
     """
-    Reads the stream until the end of the current content
-    Stops waiting for content after `timeout` seconds
-    Returns decoded content (i.e. str not bytes)
+    Reads the stream until EOF, whatever is available (up to READ_CHUNK_SIZE bytes) at a time,
+    and calls `on_text` with the decoded content (i.e. str not bytes) of each read
+    The same `decoder` carries characters split between reads over to the next one
     """
-    buffer = []
-
     while True:
-        try:
-            token = await asyncio.wait_for(stream.read(1), timeout)
-            if not token:
-                # stream.read() returns an empty byte when EOF is reached
-                break
-            token = token.decode()
-            buffer.append(token)
-            if len(buffer) > output_limit:
-                break
-
-        except asyncio.TimeoutError:
-            # No bytes have been written for at least `timeout` seconds
+        chunk = await stream.read(READ_CHUNK_SIZE)
+        # stream.read() returns an empty byte when EOF is reached
+        text = decoder.decode(chunk, final=not chunk)
+        if text:
+            on_text(text)
+        if not chunk:
             break
 
-    return ''.join(buffer)
-
 
 async def _run_with_timeout(waitable, timeout):
     fut = asyncio.Future()
@@ -265,12 +951,92 @@ async def _run_with_timeout(waitable, timeout):
     return await fut
 
 
+class _PtyReaderProtocol(asyncio.StreamReaderProtocol):
+    def connection_lost(self, exc):
+        # Reading a terminal whose program has exited fails with EIO instead of returning EOF
+        if isinstance(exc, OSError) and exc.errno == errno.EIO:
+            exc = None
+        super().connection_lost(exc)
+
+
+class _PtyStdin:
+    """The program's stdin through the terminal, with the interface of a StreamWriter"""
+
+    def __init__(self, writer: asyncio.StreamWriter, eof: bytes):
+        self.writer = writer
+        self.eof = eof
+        self.closed = False
+
+    def write(self, data: bytes):
+        self.writer.write(data)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    def close(self):
+        # A terminal stays open, so end the input the way a user would: with ^D
+        if not self.closed:
+            self.closed = True
+            self.writer.write(self.eof)
+
+
+def _check_pty_inputs(inputs: list[str], special: list[bytes]):
+    # A terminal in canonical mode cuts lines at its line buffer and interprets
+    # its line-editing characters, so such inputs would not reach the program as sent
+    lines = ''.join(inputs).encode().split(b'\n')
+    longest = max(len(line) for line in lines) + 1
+    if longest > PTY_MAX_LINE:
+        raise ValueError(f'An input line of {longest} bytes is longer than a terminal line '
+                         f'({PTY_MAX_LINE} bytes); run it without pty=True')
+    for char in special:
+        if char != b'\0' and any(char in line for line in lines):
+            raise ValueError(f'An input contains {char!r}, which a terminal does not pass on '
+                             f'to the program; run it without pty=True')
+
+
+def _open_pty(inputs: list[str]):
+    # A terminal that neither echoes the input (the transcript already has it)
+    # nor turns \n into \r\n, so the transcript is the same as through pipes.
+    # Control characters (e.g. ^C, ^S) and \r reach the program as they do through pipes;
+    # the terminal stays in canonical mode so that ^D can end the input.
+    import termios  # Unix only
+
+    controller, terminal = os.openpty()
+    attributes = termios.tcgetattr(terminal)
+    attributes[0] &= ~(termios.ICRNL | termios.INLCR | termios.IGNCR | termios.IXON | termios.ISTRIP)
+    attributes[1] &= ~termios.OPOST
+    attributes[3] &= ~(termios.ECHO | termios.ECHONL | termios.ISIG | termios.IEXTEN)
+    termios.tcsetattr(terminal, termios.TCSANOW, attributes)
+    cc = attributes[6]
+    try:
+        _check_pty_inputs(inputs, [cc[termios.VEOF], cc[termios.VERASE], cc[termios.VKILL]])
+    except ValueError:
+        os.close(controller)
+        os.close(terminal)
+        raise
+    return controller, terminal, cc[termios.VEOF]
+
+
+async def _pty_streams(controller: int, eof: bytes):
+    # A reader and a writer for the controlling side of the terminal (each owns its own fd)
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(loop=loop)
+    read_transport, _ = await loop.connect_read_pipe(
+        lambda: _PtyReaderProtocol(reader, loop=loop), os.fdopen(controller, 'rb', buffering=0))
+    write_transport, write_protocol = await loop.connect_write_pipe(
+        lambda: asyncio.streams.FlowControlMixin(loop=loop), os.fdopen(os.dup(controller), 'wb', buffering=0))
+    writer = asyncio.StreamWriter(write_transport, write_protocol, None, loop)
+    return reader, _PtyStdin(writer, eof), (read_transport, write_transport)
+
+
 async def _run_exec_with_io(
         exec: list[str],
         inputs: list[str],
         read_timeout: float,
         finish_timeout: float,
-        max_output_size: int = 10000
+        max_output_size: int = 10000,
+        echo_output: bool = True,
+        pty: bool = False
 ) -> tuple[str, str]:
     """
     Run an executable. Provided content via STDIN. Capture STDOUT.
@@ -278,17 +1044,49 @@ async def _run_exec_with_io(
     :param inputs: list of inputs to executable
                    assumes newlines have been added if they are necessary
     :param read_timeout: how long to wait after a byte is written to STDOUT before returning
+                         (on Linux, the next input is sent as soon as the program waits for it;
+                         this is then only the longest wait)
+    :param echo_output: print the transcript to the console as it happens
+    :param pty: run the program on a pseudo-terminal instead of pipes (Unix only),
+                so programs that buffer their output when it is not a terminal
+                (e.g. C stdio, Java) show each prompt as soon as they print it
+                (ValueError for input a terminal cannot pass on: lines over PTY_MAX_LINE bytes,
+                or its erase, kill and end-of-file characters)
     :return: Nothing. But output and error will be populated when finished.
     """
+    loop = asyncio.get_running_loop()
+    # (time, text) of each piece of the transcript: the output as it is read and each input as it is sent
+    transcript = []
     output_size = 0
-    output = []
     error = []
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    last_output = loop.time()
+    activity = asyncio.Event()
+    output_closed = False
 
-    print(' '.join(exec))
-    PIPE = asyncio.subprocess.PIPE
-    proc = await asyncio.create_subprocess_exec(
-        *exec, stdin=PIPE, stdout=PIPE, stderr=asyncio.subprocess.STDOUT)
+    def echo(text):
+        if echo_output:
+            sys.stdout.write(text)
+            sys.stdout.flush()
 
+    echo(' '.join(exec) + '\n')
+    if pty:
+        controller, terminal, eof = _open_pty(inputs)
+        try:
+            proc = await asyncio.create_subprocess_exec(*exec, stdin=terminal, stdout=terminal, stderr=terminal)
+        except BaseException:
+            os.close(controller)
+            raise
+        finally:
+            os.close(terminal)
+        stdout, stdin, transports = await _pty_streams(controller, eof)
+    else:
+        PIPE = asyncio.subprocess.PIPE
+        proc = await asyncio.create_subprocess_exec(
+            *exec, stdin=PIPE, stdout=PIPE, stderr=asyncio.subprocess.STDOUT)
+        stdout, stdin, transports = proc.stdout, proc.stdin, ()
+
+    waiting_for_input = stdin_waiter(proc.pid)
     timeout_task = asyncio.create_task(asyncio.sleep(finish_timeout))
 
     def kill(t):
@@ -297,61 +1095,116 @@ async def _run_exec_with_io(
 
     timeout_task.add_done_callback(kill)
 
-    output.append(await _read_stream(proc.stdout, read_timeout, max_output_size - output_size))
-    output_size += len(output[-1])
-    print(output[-1], end='')
-    if output_size > max_output_size:
-        error.append(f'Program output exceeded limit of {max_output_size} characters')
-        proc.kill()
-        inputs = []  # i.e. skip the input loop and cut to the finish
+    def receive(text):
+        nonlocal output_size, last_output
+        last_output = loop.time()
+        activity.set()
+        if output_size > max_output_size:
+            return  # Already cut off
+        transcript.append((last_output, text))
+        output_size += len(text)
+        echo(text)
+        if output_size > max_output_size:
+            error.append(f'Program output exceeded limit of {max_output_size} characters')
+            proc.kill()
+
+    async def read_output():
+        # Runs for the whole life of the program, so it never stalls on a full pipe
+        nonlocal output_closed
+        await _pump_stream(stdout, decoder, receive)
+        output_closed = True
+        activity.set()
+
+    async def until_quiet():
+        # Until the program waits for input, prints nothing for read_timeout seconds, or closes its output
+        phase_start = loop.time()
+        blocked = False
+        while not output_closed and output_size <= max_output_size:
+            remaining = max(phase_start, last_output) + read_timeout - loop.time()
+            if remaining <= 0:
+                return
+            if waiting_for_input is not None:
+                remaining = min(remaining, STDIN_POLL_INTERVAL)
+            activity.clear()
+            try:
+                await asyncio.wait_for(activity.wait(), remaining)
+                blocked = False
+                continue
+            except asyncio.TimeoutError:
+                pass
+            if waiting_for_input is not None and waiting_for_input():
+                if blocked:
+                    # Blocked for a whole poll, so all it wrote before blocking has been read
+                    return
+                blocked = True
+            else:
+                blocked = False
+
+    reader = asyncio.create_task(read_output())
+    await until_quiet()
 
     for i in range(len(inputs)):
         content = inputs[i]
+        if output_size > max_output_size:
+            break  # i.e. skip the rest of the inputs and cut to the finish
+        if output_closed and proc.returncode is None:
+            # Its output closes as it exits; give the exit a moment to be seen
+            try:
+                await asyncio.wait_for(proc.wait(), read_timeout)
+            except asyncio.TimeoutError:
+                pass
         if proc.returncode is not None:
             # Process has completed
             error.append('The program exited before all inputs were provided')
             break
 
-        output.append(content)
-        output_size += len(output[-1])
-        print(output[-1], end='')
+        transcript.append((loop.time(), content))
+        output_size += len(content)
+        echo(content)
 
-        proc.stdin.write(content.encode())
-        await proc.stdin.drain()
+        try:
+            stdin.write(content.encode())
+            await stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            error.append('The program exited before all inputs were provided')
+            break
 
         if i == len(inputs) - 1:
             # close stdin
-            proc.stdin.close()
+            stdin.close()
 
-        response = await _read_stream(proc.stdout, read_timeout, max_output_size - output_size)
+        await until_quiet()
 
-        output.append(response)
-        output_size += len(output[-1])
-        print(output[-1], end='')
-        if output_size > max_output_size:
-            error.append(f'Program output exceeded limit of {max_output_size} characters')
-            proc.kill()
-            break
-
-    proc.stdin.close()
+    stdin.close()
     code = await proc.wait()
+    try:
+        # The rest of the output (unless a process the program started still holds it open)
+        await asyncio.wait_for(reader, read_timeout)
+    except asyncio.TimeoutError:
+        pass
 
     timeout_task.remove_done_callback(kill)
     timeout_task.cancel()
+    for transport in transports:
+        transport.close()
 
     if code != 0:
         error.append(f'The program returned a non-zero exit code: {code}')
 
-    return ''.join(output), '\n'.join(error)
+    # Everything happens on this event loop, so the pieces interleave in the order they happened
+    transcript.sort(key=lambda piece: piece[0])
+    return ''.join(text for _, text in transcript), '\n'.join(error)
 
 
-def _run_exec(executable, *args, inputs=None, read_timeout=1, run_timeout=60):
+async def _run_exec_async(executable, *args, inputs=None, read_timeout=1, run_timeout=60,
+                          echo_output=True, pty=False):
     args = [executable, *(str(a) for a in args)]
 
-    output, error = asyncio.run(_run_exec_with_io(
+    output, error = await _run_exec_with_io(
         args, [c + '\n' for c in (inputs or [])],
-        read_timeout=read_timeout, finish_timeout=run_timeout
-    ))
+        read_timeout=read_timeout, finish_timeout=run_timeout,
+        echo_output=echo_output, pty=pty
+    )
 
     if error:
         output += '\nError: ' + error
@@ -359,6 +1212,10 @@ def _run_exec(executable, *args, inputs=None, read_timeout=1, run_timeout=60):
     return output
 
 
+def _run_exec(executable, *args, **kwargs):
+    return asyncio.run(_run_exec_async(executable, *args, **kwargs))
+
+
 def _run_script(
         script_name, *args,
         inputs: list[str] = None,
@@ -416,36 +1273,83 @@ def _run_script(
     return ''.join(output_tokens)
 
 
-def _run_dialog(runner,
-                executable, *args,
-                expected_stdio: PS = None,
-                expected_files: list[tuple[PS, PS]] = None,
-                **kwargs) -> dict:
-    if expected_stdio is not None and not isinstance(expected_stdio, Path):
-        expected_stdio = Path(expected_stdio)
+# Scripts run by run_script share this process's sys.argv, so only one runs at a time
+_SCRIPT_LOCK = threading.Lock()
+
+
+async def _run_script_async(script_name, *args, **kwargs):
+    def run():
+        with _SCRIPT_LOCK:
+            return _run_script(script_name, *args, **kwargs)
+
+    return await asyncio.to_thread(run)
 
+
+def _dialog_paths(expected_stdio, expected_files):
     to_path = lambda f: Path(f) if not isinstance(f, Path) else f
+    if isinstance(expected_stdio, (list, tuple)):
+        # Any of these dialogs is an acceptable transcript
+        expected_stdio = [to_path(f) for f in expected_stdio]
+    elif expected_stdio is not None:
+        expected_stdio = to_path(expected_stdio)
+
     expected_files = [
         (to_path(ex), to_path(ob)) for ex, ob in (expected_files or [])
     ]
+    return expected_stdio, expected_files
 
-    try:
-        # Ensure the output files aren't leftover from a previous run
-        for _, obs_file in expected_files:
-            _ensure_absent(obs_file)
 
-        if callable(executable):
-            executable = executable()
+def _prepare_dialog(executable, args, expected_stdio, expected_files):
+    # Returns the executable, args, inputs and expected output of the run
 
-        args = [arg() if callable(arg) else arg for arg in args]
+    # Ensure the output files aren't leftover from a previous run
+    for _, obs_file in expected_files:
+        _ensure_absent(obs_file)
 
-        # Run the script
-        if expected_stdio is not None:
-            inputs, expected_io = _extract_input(expected_stdio.read_text())
-        else:
-            inputs = []
-            expected_io = None
+    if callable(executable):
+        executable = executable()
+
+    args = [arg() if callable(arg) else arg for arg in args]
 
+    if isinstance(expected_stdio, list):
+        inputs, expected_io = _extract_alternative_inputs(expected_stdio)
+    elif expected_stdio is not None:
+        expected_io = _load_dialog(expected_stdio)
+        inputs = list(expected_io.inputs)
+    else:
+        inputs = []
+        expected_io = None
+
+    return executable, args, inputs, expected_io
+
+
+def _load_tests_failure():
+    return {
+        'load-tests': {
+            'group_name': 'load-tests',
+            'expected': '',
+            'observed': traceback.format_exc(),
+            'score': 0,
+            'max_score': 1,
+            'passed': False,
+        }
+    }
+
+
+def _run_dialog(runner,
+                executable, *args,
+                expected_stdio: Union[PS, list[PS]] = None,
+                expected_files: list[tuple[PS, PS]] = None,
+                granularity: str = None,
+                **kwargs) -> dict:
+    expected_stdio, expected_files = _dialog_paths(expected_stdio, expected_files)
+
+    try:
+        executable, args, inputs, expected_io = _prepare_dialog(
+            executable, args, expected_stdio, expected_files
+        )
+
+        # Run the script
         output = runner(
             executable, *args,
             inputs=inputs, **kwargs
@@ -453,48 +1357,187 @@ def _run_dialog(runner,
 
         # Score results
         group_stats = _score_output(
-            expected_io, output, expected_files
+            expected_io, output, expected_files, granularity
         )
 
     except Exception as ex:
-        group_stats = {
-            'load-tests': {
-                'group_name': 'load-tests',
-                'expected': '',
-                'observed': traceback.format_exc(),
-                'score': 0,
-                'max_score': 1,
-                'passed': False,
-            }
-        }
+        group_stats = _load_tests_failure()
+
+    return group_stats
+
+
+async def _run_dialog_async(runner,
+                            executable, *args,
+                            expected_stdio: Union[PS, list[PS]] = None,
+                            expected_files: list[tuple[PS, PS]] = None,
+                            granularity: str = None,
+                            **kwargs) -> dict:
+    # _run_dialog with a coroutine runner
+    expected_stdio, expected_files = _dialog_paths(expected_stdio, expected_files)
+
+    try:
+        executable, args, inputs, expected_io = _prepare_dialog(
+            executable, args, expected_stdio, expected_files
+        )
+
+        output = await runner(
+            executable, *args,
+            inputs=inputs, **kwargs
+        )
+
+        # Alignment is CPU-bound, so it runs in a thread while the other dialogs keep going
+        group_stats = await asyncio.to_thread(
+            _score_output, expected_io, output, expected_files, granularity
+        )
+
+    except Exception as ex:
+        group_stats = _load_tests_failure()
 
     return group_stats
 
 
 def run_exec(executable, *args,
-             expected_stdio: PS = None,
+             expected_stdio: Union[PS, list[PS]] = None,
              expected_files: list[tuple[PS, PS]] = None,
-             read_timeout=1) -> dict:
+             read_timeout=1,
+             granularity: str = None,
+             echo_output=True,
+             pty=False) -> dict:
     return _run_dialog(
         _run_exec, executable, *args,
         expected_stdio=expected_stdio,
         expected_files=expected_files,
-        read_timeout=read_timeout)
+        granularity=granularity,
+        read_timeout=read_timeout,
+        echo_output=echo_output,
+        pty=pty)
 
 
 def run_script(script_name, *args,
-               expected_stdio: Path = None,
+               expected_stdio: Union[Path, list[Path]] = None,
                expected_files: list[tuple[Path, Path]] = None,
                module='__main__',
-               echo_output=True
+               echo_output=True,
+               granularity: str = None
                ) -> dict:
     return _run_dialog(
         _run_script, script_name, *args,
         expected_stdio=expected_stdio,
         expected_files=expected_files,
+        granularity=granularity,
         module=module, echo_output=echo_output)
 
 
+async def run_exec_async(executable, *args,
+                         expected_stdio: Union[PS, list[PS]] = None,
+                         expected_files: list[tuple[PS, PS]] = None,
+                         read_timeout=1,
+                         granularity: str = None,
+                         echo_output=True,
+                         pty=False) -> dict:
+    """run_exec as a coroutine, so many dialogs can run at once on one event loop (see run_many)"""
+    return await _run_dialog_async(
+        _run_exec_async, executable, *args,
+        expected_stdio=expected_stdio,
+        expected_files=expected_files,
+        granularity=granularity,
+        read_timeout=read_timeout,
+        echo_output=echo_output,
+        pty=pty)
+
+
+async def run_script_async(script_name, *args,
+                           expected_stdio: Union[Path, list[Path]] = None,
+                           expected_files: list[tuple[Path, Path]] = None,
+                           module='__main__',
+                           echo_output=True,
+                           granularity: str = None
+                           ) -> dict:
+    """
+    run_script as a coroutine
+    The script runs in a worker thread; as scripts share this process, only one runs at a time
+    """
+    return await _run_dialog_async(
+        _run_script_async, script_name, *args,
+        expected_stdio=expected_stdio,
+        expected_files=expected_files,
+        granularity=granularity,
+        module=module, echo_output=echo_output)
+
+
+def run_many(dialogs, max_concurrency: int = 8) -> list[dict]:
+    """
+    Run many dialogs concurrently on one event loop
+
+    Most of a dialog's time is spent waiting on the program, so running them
+    together takes about as long as the slowest one rather than all of them.
+    Dialogs that write the same expected_files output must not run together.
+
+    :param dialogs: coroutines from run_exec_async or run_script_async
+    :param max_concurrency: the most dialogs running at once
+    :return: the group stats of each dialog, in the same order
+    """
+    async def run_all():
+        limit = asyncio.Semaphore(max_concurrency)
+
+        async def run(dialog):
+            async with limit:
+                return await dialog
+
+        return await asyncio.gather(*(run(dialog) for dialog in dialogs))
+
+    return list(asyncio.run(run_all()))
+
+
+def score_outputs(observed_outputs: dict[str, str],
+                  expected_stdio: PS,
+                  granularity: str = None) -> tuple[dict[str, dict], list[dict]]:
+    """
+    Score the stdout of many submissions against one dialog file
+
+    Outputs are grouped by hash, so each distinct output is aligned only once
+    and its group stats are copied to every submission that produced it.
+
+    :param observed_outputs: submission id -> observed output (with the inputs echoed, as run_exec records it)
+    :return: the group stats of each submission,
+             and the clusters of identical outputs, largest first, as dicts of
+             'hash', 'size', 'submissions', 'score' and 'passed'
+    """
+    expected_io = _load_dialog(Path(expected_stdio))
+
+    clusters = defaultdict(list)
+    outputs = {}
+    for submission, observed in observed_outputs.items():
+        digest = hashlib.sha256(observed.encode(errors='surrogatepass')).hexdigest()
+        clusters[digest].append(submission)
+        outputs[digest] = observed
+
+    stats = {
+        digest: _score_output(expected_io, observed, [], granularity=granularity)
+        for digest, observed in outputs.items()
+    }
+
+    results = {}
+    for digest, submissions in clusters.items():
+        for submission in submissions:
+            # Each submission gets its own copy, as the stats are scaled in place by the plugin
+            results[submission] = copy.deepcopy(stats[digest])
+
+    cluster_info = [
+        {
+            'hash': digest,
+            'size': len(submissions),
+            'submissions': submissions,
+            'score': stats[digest]['stdout']['score'],
+            'passed': stats[digest]['stdout']['passed'],
+        }
+        for digest, submissions in clusters.items()
+    ]
+    cluster_info.sort(key=lambda cluster: cluster['size'], reverse=True)
+
+    return {submission: results[submission] for submission in observed_outputs}, cluster_info
+
+
 #
 # Deprecated
 #
@@ -1,4 +1,170 @@
 import math
+import re
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import partial
+from itertools import groupby
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; without it only the python engine is available
+    np = None
+
+ENGINES = ('python', 'numpy')
+MODES = ('full', 'hirschberg', 'banded')
+
+# Subproblems at or below this many cells are aligned with a full traceback
+# matrix by the hirschberg mode instead of being split further
+HIRSCHBERG_BASE_CELLS = 250_000
+
+# The banded mode starts with cells within this many diagonals of the main one
+# and doubles the band until the result is provably optimal
+BAND_START = 32
+
+# Unique-line anchors only split the text left after trimming the common prefix
+# and suffix when aligning it whole would take more than this many cells.
+# Anchoring is a heuristic: on small inputs it can cost a few points of score.
+ANCHOR_MIN_CELLS = 1_000_000
+
+# Tokens for token-level alignment: runs of whitespace and runs of anything else
+TOKEN_PATTERN = re.compile(r'\s+|\S+')
+
+# Token ids are written as characters from the private use area up,
+# which contains no line breaks (so line-level alignment still works on them)
+_TOKEN_ID_START = 0xE000
+
+
+class AlignmentTimeout(TimeoutError):
+    """Raised when an alignment is still running at its deadline"""
+
+
+def check_deadline(deadline):
+    """Raise AlignmentTimeout once time.monotonic() is past `deadline` (None never expires)"""
+    if deadline is not None and time.monotonic() > deadline:
+        raise AlignmentTimeout('The alignment did not finish within its time budget')
+
+
+@dataclass
+class EditScript:
+    """
+    An alignment of observed against expected as runs of (op, length).
+
+    The ops follow CIGAR: '=' same characters in both, 'X' a substituted character,
+    'I' characters only in observed, 'D' characters only in expected.
+    """
+    observed: str
+    expected: str
+    runs: list[tuple[str, int]]
+
+    def segments(self):
+        """Yield (op, observed text, expected text) for each run; the gap side is ''"""
+        o = 0
+        e = 0
+        for op, length in self.runs:
+            obs_length = 0 if op == 'D' else length
+            exp_length = 0 if op == 'I' else length
+            yield op, self.observed[o:o + obs_length], self.expected[e:e + exp_length]
+            o += obs_length
+            e += exp_length
+
+    def aligned(self, gap='~') -> tuple[str, str]:
+        """The observed and expected text padded with `gap` to line up with each other"""
+        align1 = []
+        align2 = []
+        for op, obs_text, exp_text in self.segments():
+            align1.append(obs_text or gap * len(exp_text))
+            align2.append(exp_text or gap * len(obs_text))
+        return ''.join(align1), ''.join(align2)
+
+
+def extend_runs(runs, more):
+    """Append runs to `runs`, merging the two runs where they meet if they have the same op"""
+    for op, length in more:
+        if not length:
+            continue
+        if runs and runs[-1][0] == op:
+            runs[-1] = (op, runs[-1][1] + length)
+        else:
+            runs.append((op, length))
+    return runs
+
+
+def edit_script(
+        observed: str,
+        expected: str,
+        MATCH=1,
+        SUB=-1,
+        GAP_OPEN=-3,
+        GAP_EXTEND=-1,
+        engine: str = None,
+        mode: str = 'full',
+        max_band: int = None,
+        anchor: bool = True,
+        score_only: bool = False,
+        cutoff: float = None,
+        deadline: float = None
+) -> tuple[float, EditScript]:
+    """
+    Align observed against expected with affine gap penalties
+
+    :param engine: 'numpy' (Gotoh matrices in typed arrays, filled a row at a time)
+                   or 'python' (the original dict-based Needleman-Wunsch).
+                   Defaults to 'numpy' when NumPy is installed.
+                   The python engine only keeps the best way into each cell, so it can
+                   miss the best alignment when a gap is better opened than extended;
+                   the numpy engine tracks the three Gotoh states and always finds it,
+                   so on some inputs it scores higher than the python engine did
+                   (e.g. -20.0 instead of -22). It returns the score as a float.
+    :param mode: 'full' keeps a traceback pointer for every cell.
+                 'hirschberg' splits the problem in half recursively and only keeps
+                 O(len(observed) + len(expected)) state; it needs the numpy engine.
+                 'banded' only fills cells near the diagonal, widening the band until
+                 no path outside it could score better; it needs the numpy engine.
+    :param max_band: stop widening the band past this many diagonals and return
+                     the best alignment found inside it (banded mode only)
+    :param anchor: before building any matrix, match the common prefix and suffix;
+                   when what remains is large, also split it at lines that occur exactly
+                   once in both (patience diff anchors) and align each piece on its own
+    :param score_only: only compute the score; no traceback is stored and
+                       the edit script is returned as None
+    :param cutoff: give up as soon as the best score still reachable falls below this
+                   (every remaining character a match and no further gap openings);
+                   (None, None) is returned when the score is below the cutoff
+    :param deadline: a time.monotonic() value; AlignmentTimeout is raised
+                     if the alignment is still running after it
+    :return: the alignment score and the edit script
+    """
+    if engine is None:
+        engine = 'numpy' if np is not None else 'python'
+    if mode not in MODES:
+        raise ValueError(f'Unknown edit_dist mode {mode!r}; expected one of {MODES}')
+
+    if engine == 'python':
+        if mode != 'full':
+            raise ValueError(f"The 'python' edit_dist engine does not support mode {mode!r}")
+        align = partial(_python_align,
+                        MATCH=MATCH, SUB=SUB, GAP_OPEN=GAP_OPEN, GAP_EXTEND=GAP_EXTEND,
+                        deadline=deadline)
+    elif engine == 'numpy':
+        if np is None:
+            raise ImportError("The 'numpy' edit_dist engine requires NumPy to be installed")
+        align = partial(_numpy_align,
+                        MATCH=MATCH, SUB=SUB, GAP_OPEN=GAP_OPEN, GAP_EXTEND=GAP_EXTEND,
+                        mode=mode, max_band=max_band, deadline=deadline)
+    else:
+        raise ValueError(f'Unknown edit_dist engine {engine!r}; expected one of {ENGINES}')
+
+    if anchor:
+        scores = (MATCH, SUB, GAP_OPEN, GAP_EXTEND)
+        score, runs = _anchored_align(observed, expected, align, scores, score_only, cutoff)
+    else:
+        score, runs = align(observed, expected, score_only=score_only, cutoff=cutoff)
+
+    if runs is None:
+        return score, None
+    return score, EditScript(observed, expected, runs)
 
 
 def edit_dist(
@@ -8,8 +174,415 @@ def edit_dist(
         MATCH=1,
         SUB=-1,
         GAP_OPEN=-3,
-        GAP_EXTEND=-1
+        GAP_EXTEND=-1,
+        **kwargs
 ) -> tuple[float, str, str]:
+    """
+    Align observed against expected with affine gap penalties
+    Takes the same options as edit_script.
+
+    :return: the alignment score and the two gap-padded aligned strings
+             (None for both with score_only, and (None, None, None) below a cutoff)
+    """
+    score, script = edit_script(observed, expected, MATCH, SUB, GAP_OPEN, GAP_EXTEND, **kwargs)
+    if script is None:
+        return score, None, None
+    return (score, *script.aligned(GAP))
+
+
+def edit_dist_many(
+        observed_list: list[str],
+        expected: str,
+        align=lambda distance: distance > 0,
+        **kwargs
+) -> list[tuple[int, tuple[float, str, str]]]:
+    """
+    Levenshtein distance of many observed outputs from one expected output
+
+    The expected text is preprocessed once into one match bit-vector per character,
+    then each observed output is scored with Myers' bit-parallel algorithm
+    (Hyyro's global variant), using Python ints as arbitrarily wide words.
+
+    :param align: called with each distance; the output is only fully aligned
+                  with edit_dist (using the remaining keyword arguments) when it returns True
+    :return: (distance, edit_dist result or None) for each observed output
+    """
+    peq = _match_vectors(expected)
+    results = []
+    for observed in observed_list:
+        distance = _bit_parallel_distance(observed, len(expected), peq)
+        alignment = edit_dist(observed, expected, **kwargs) if align(distance) else None
+        results.append((distance, alignment))
+    return results
+
+
+def best_alternative(
+        observed: str,
+        alternatives: list[str],
+        MATCH=1,
+        SUB=-1,
+        GAP_OPEN=-3,
+        GAP_EXTEND=-1,
+        max_cells: int = None,
+        deadline: float = None
+) -> tuple[int, float]:
+    """
+    The index and alignment score of the expected alternative that observed aligns with best
+
+    The start and end that observed shares with every alternative are matched as they are.
+    With NumPy the rest of the alternatives is walked as a trie: the Gotoh rows of a prefix
+    shared by several alternatives are filled once, so the cost grows with the
+    total distinct text rather than the number of alternatives times their length.
+    Ties go to the earliest alternative.
+
+    :param max_cells: when aligning would fill more cells than this (observed characters
+                      times distinct alternative characters), or when it is still running
+                      at `deadline`, the alternatives are ranked by their Levenshtein distance
+                      from observed instead (bit-parallel, so much cheaper), and the score
+                      returned is minus that distance
+    """
+    if not alternatives:
+        raise ValueError('best_alternative needs at least one alternative')
+    prefix = min(common_prefix_length(observed, expected) for expected in alternatives)
+    suffix = min(_common_suffix_length(observed[prefix:], expected[prefix:]) for expected in alternatives)
+    observed = observed[prefix:len(observed) - suffix]
+    alternatives = [expected[prefix:len(expected) - suffix] for expected in alternatives]
+
+    scored = None
+    if max_cells is None or (len(observed) + 1) * (_trie_size(alternatives) + 1) <= max_cells:
+        try:
+            if np is None:
+                scored = [
+                    edit_script(observed, expected, MATCH, SUB, GAP_OPEN, GAP_EXTEND, score_only=True,
+                                deadline=deadline)[0]
+                    for expected in alternatives
+                ]
+            else:
+                scores = (MATCH, SUB, GAP_OPEN, GAP_EXTEND)
+                scored = _trie_scores(_encode(observed), [_encode(expected) for expected in alternatives], scores,
+                                      deadline)
+            scored = [MATCH * (prefix + suffix) + score for score in scored]
+        except AlignmentTimeout:
+            pass
+    if scored is None:
+        scored = [
+            -float(_bit_parallel_distance(observed, len(expected), _match_vectors(expected)))
+            for expected in alternatives
+        ]
+
+    best = max(range(len(alternatives)), key=lambda index: (scored[index], -index))
+    return best, scored[best]
+
+
+def pattern_edit_script(
+        observed: str,
+        segments: list,
+        MATCH=1,
+        SUB=-1,
+        GAP_OPEN=-3,
+        GAP_EXTEND=-1,
+        deadline: float = None
+) -> tuple[float, EditScript, list[tuple[int, int]]]:
+    """
+    Align observed against expected text made of literal strings and patterns
+
+    A pattern is any object with a `spans(observed)` method, returning the (start, end)
+    spans of observed it matches, and a `placeholder` string that stands for it in
+    the expected text when it matches nothing.
+    Each pattern is a single row of the Gotoh matrices: matching a span of any length
+    is one step worth MATCH, and leaving the pattern unmatched is a one-step gap.
+    The rows of the literal text are filled by the numpy engine, each segment continuing
+    from the final row of the one before.
+
+    :return: the alignment score, the edit script (whose expected text has each pattern
+             replaced by the observed text it matched, or by its placeholder),
+             and the span each pattern matched (None if unmatched)
+    """
+    if np is None:
+        raise ImportError('pattern_edit_script requires NumPy to be installed')
+    scores = (MATCH, SUB, GAP_OPEN, GAP_EXTEND)
+    obs = _encode(observed)
+
+    row, ptrs = _gotoh_fill(obs, obs[:0], scores, deadline=deadline)
+    filled = [(None, ptrs)]
+    for segment in segments:
+        if isinstance(segment, str):
+            if not segment:
+                continue
+            row, ptrs = _gotoh_fill(obs, _encode(segment), scores, init=row, deadline=deadline)
+        else:
+            check_deadline(deadline)
+            row, ptrs = _pattern_row(row, segment.spans(observed), scores)
+        filled.append((segment, ptrs))
+
+    score, state = _end_scores(row, scores, False)
+    path = _segment_traceback(filled, int(state[0]), len(observed))
+
+    # Walk the path forward, writing out the expected text as it was matched
+    literal = ''.join(segment for segment in segments if isinstance(segment, str))
+    patterns = iter(segment for segment in segments if not isinstance(segment, str))
+    expected = []
+    matches = []
+    runs = []
+    o = 0
+    e = 0
+    for step in path:
+        if step == _M:
+            expected.append(literal[e])
+            extend_runs(runs, [('=' if observed[o] == literal[e] else 'X', 1)])
+            o += 1
+            e += 1
+        elif step == _X:
+            expected.append(literal[e])
+            extend_runs(runs, [('D', 1)])
+            e += 1
+        elif step == _Y:
+            extend_runs(runs, [('I', 1)])
+            o += 1
+        elif step is None:
+            placeholder = next(patterns).placeholder
+            expected.append(placeholder)
+            extend_runs(runs, [('D', len(placeholder))])
+            matches.append(None)
+        else:
+            next(patterns)
+            start, o = step
+            expected.append(observed[start:o])
+            extend_runs(runs, [('=', o - start)])
+            matches.append(step)
+
+    return float(score[0]), EditScript(observed, ''.join(expected), runs), matches
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into tokens (runs of whitespace and runs of non-whitespace) that join back into it"""
+    return TOKEN_PATTERN.findall(text)
+
+
+def token_ids(*token_lists: list[str]) -> list[str]:
+    """Each list of tokens as a string with one character per token; equal tokens get the same character"""
+    ids = {}
+    for tokens in token_lists:
+        for token in tokens:
+            if token not in ids:
+                if _TOKEN_ID_START + len(ids) > 0x10FFFF:
+                    raise ValueError('Too many distinct tokens to align')
+                ids[token] = chr(_TOKEN_ID_START + len(ids))
+    return [''.join(ids[token] for token in tokens) for tokens in token_lists]
+
+
+def token_runs(script: EditScript, obs_tokens: list[str], exp_tokens: list[str]) -> list[tuple[str, int]]:
+    """
+    Character runs for an edit script over token ids.
+    A substituted token is wrong as a whole, so none of its characters count as matching.
+    """
+    runs = []
+    o = 0
+    e = 0
+    for op, length in script.runs:
+        obs = obs_tokens[o:o + (0 if op == 'D' else length)]
+        exp = exp_tokens[e:e + (0 if op == 'I' else length)]
+        o += len(obs)
+        e += len(exp)
+        if op == '=':
+            extend_runs(runs, [('=', sum(len(token) for token in exp))])
+        elif op == 'X':
+            for obs_token, exp_token in zip(obs, exp):
+                common = min(len(obs_token), len(exp_token))
+                extend_runs(runs, [
+                    ('X', common),
+                    ('I', len(obs_token) - common),
+                    ('D', len(exp_token) - common)
+                ])
+        else:
+            extend_runs(runs, [(op, sum(len(token) for token in obs or exp))])
+    return runs
+
+
+def _match_vectors(expected: str) -> dict[str, int]:
+    """For each character, an int with bit i set where expected[i] is that character"""
+    reverse = expected[::-1]  # int() reads the most significant bit first
+    zeros = {ord(c): '0' for c in set(expected)}
+    peq = {}
+    for c in zeros:
+        bits = reverse.translate({**zeros, c: '1'})
+        peq[chr(c)] = int(bits, 2)
+    return peq
+
+
+def _bit_parallel_distance(observed: str, m: int, peq: dict[str, int]) -> int:
+    if m == 0:
+        return len(observed)
+
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv = mask  # vertical deltas of +1
+    mv = 0  # vertical deltas of -1
+    distance = m
+    for c in observed:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & last:
+            distance += 1
+        elif mh & last:
+            distance -= 1
+        # The top row of a global alignment grows by one every column
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+    return distance
+
+
+def alignment_settings() -> tuple:
+    """
+    Everything besides the texts and options that decides which alignment is found
+    (e.g. for keys of cached scores)
+    """
+    return 'numpy' if np is not None else 'python', HIRSCHBERG_BASE_CELLS, BAND_START, ANCHOR_MIN_CELLS
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    """The length of the longest common prefix of `a` and `b`"""
+    # Binary search with slice comparisons, which run at memcmp speed
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix_length(a: str, b: str) -> int:
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def unique_line_anchors(obs_lines: list[str], exp_lines: list[str]) -> list[tuple[int, int]]:
+    """
+    Pairs of (observed line, expected line) indices of lines that occur exactly once
+    in each, keeping the longest run of pairs that is in order in both (patience diff)
+    """
+    def unique(lines):
+        seen = {}
+        for index, line in enumerate(lines):
+            seen[line] = None if line in seen else index
+        return seen
+
+    obs_unique = unique(obs_lines)
+    exp_unique = unique(exp_lines)
+    pairs = [
+        (o, exp_unique[line]) for line, o in obs_unique.items()
+        if o is not None and exp_unique.get(line) is not None
+    ]
+    pairs.sort()
+
+    # Longest increasing subsequence of expected indices by patience sorting
+    tops = []
+    tails = []
+    back = []
+    for k, (_, e) in enumerate(pairs):
+        pile = bisect_left(tops, e)
+        back.append(tails[pile - 1] if pile else -1)
+        if pile == len(tops):
+            tops.append(e)
+            tails.append(k)
+        else:
+            tops[pile] = e
+            tails[pile] = k
+
+    anchors = []
+    k = tails[-1] if tails else -1
+    while k >= 0:
+        anchors.append(pairs[k])
+        k = back[k]
+    anchors.reverse()
+    return anchors
+
+
+def _score_upper_bound(n, m, scores):
+    """No alignment of n against m characters can score more than this"""
+    MATCH, SUB, OPEN, EXTEND = scores
+    return max(MATCH, SUB) * min(n, m) + (OPEN + EXTEND * abs(n - m) if n != m else 0)
+
+
+def _anchored_align(observed, expected, align, scores, score_only=False, cutoff=None):
+    """
+    Align the text between the common prefix and suffix piece by piece,
+    using unique matching lines as fixed points, and stitch the runs together
+    """
+    MATCH = scores[0]
+    prefix = common_prefix_length(observed, expected)
+    suffix = _common_suffix_length(observed[prefix:], expected[prefix:])
+    obs_middle = observed[prefix:len(observed) - suffix]
+    exp_middle = expected[prefix:len(expected) - suffix]
+
+    obs_lines = obs_middle.splitlines(keepends=True)
+    exp_lines = exp_middle.splitlines(keepends=True)
+    if (len(obs_middle) + 1) * (len(exp_middle) + 1) > ANCHOR_MIN_CELLS:
+        anchors = unique_line_anchors(obs_lines, exp_lines)
+    else:
+        anchors = []
+
+    # (observed piece, expected piece, matching line after them)
+    pieces = []
+    o = 0
+    e = 0
+    for o_line, e_line in anchors + [(len(obs_lines), len(exp_lines))]:
+        line = obs_lines[o_line] if o_line < len(obs_lines) else ''
+        pieces.append((''.join(obs_lines[o:o_line]), ''.join(exp_lines[e:e_line]), line))
+        o = o_line + 1
+        e = e_line + 1
+
+    # With a cutoff, each piece must score at least what is left of it
+    # after the matched text and the best the other pieces could do
+    score = MATCH * (prefix + suffix + sum(len(line) for _, _, line in pieces))
+    reachable = sum(_score_upper_bound(len(op), len(ep), scores) for op, ep, _ in pieces)
+
+    runs = [('=', prefix)] if prefix else []
+    for obs_piece, exp_piece, line in pieces:
+        if obs_piece or exp_piece:
+            reachable -= _score_upper_bound(len(obs_piece), len(exp_piece), scores)
+            piece_cutoff = None if cutoff is None else cutoff - score - reachable
+            piece_score, piece_runs = align(obs_piece, exp_piece, score_only=score_only, cutoff=piece_cutoff)
+            if piece_score is None:
+                return None, None
+            score += piece_score
+            if not score_only:
+                extend_runs(runs, piece_runs)
+        if not score_only:
+            extend_runs(runs, [('=', len(line))])
+
+    if cutoff is not None and score < cutoff:
+        return None, None
+    if score_only:
+        return score, None
+    return score, extend_runs(runs, [('=', suffix)])
+
+
+def _python_align(observed, expected, MATCH, SUB, GAP_OPEN, GAP_EXTEND,
+                  score_only=False, cutoff=None, deadline=None):
+    # The python engine always builds the full matrix; the cutoff is only checked at the end
+    score, runs = _python_edit_dist(observed, expected, MATCH, SUB, GAP_OPEN, GAP_EXTEND, deadline)
+    if cutoff is not None and score < cutoff:
+        return None, None
+    if score_only:
+        return score, None
+    return score, runs
+
+
+def _python_edit_dist(observed, expected, MATCH, SUB, GAP_OPEN, GAP_EXTEND, deadline=None):
     """
     Align seq1 against seq2 using Needleman-Wunsch
     Put seq1 on left (j) and seq2 on top (i)
@@ -52,6 +625,8 @@ def edit_dist(
         i += 1  # adjust for extra row at beginning of matrix
         sj = j
         j += 1  # adjust for extra column at beginning of matrix
+        if sj == 0:
+            check_deadline(deadline)
         # Which of the three paths is best?
         match = score_matrix[i - 1, j - 1] \
                 + (MATCH if observed[sj] == expected[si] else SUB)
@@ -84,8 +659,7 @@ def edit_dist(
     align_path = list(reversed(align_path))
 
     # Interpret alignment
-    align1 = ''
-    align2 = ''
+    ops = []
     a1 = 0
     a2 = 0
     for (pi, pj), (ci, cj) in zip(align_path[:-1], align_path[1:]):
@@ -93,17 +667,438 @@ def edit_dist(
         di = ci - pi
         dj = cj - pj
         if di == 1 and dj == 1:  # match
-            align1 += observed[a1]
+            ops.append('=' if observed[a1] == expected[a2] else 'X')
             a1 += 1
-            align2 += expected[a2]
             a2 += 1
         elif di == 1:  # gap1 -> took from seq2, but not seq1
-            align1 += GAP
-            align2 += expected[a2]
+            ops.append('D')
             a2 += 1
         else:  # gap2 -> took from seq1, but not seq2
-            align1 += observed[a1]
+            ops.append('I')
             a1 += 1
-            align2 += GAP
 
-    return score_matrix[len2, len1], align1, align2
+    runs = [(op, sum(1 for _ in group)) for op, group in groupby(ops)]
+    return score_matrix[len2, len1], runs
+
+
+# Gotoh states for the numpy engine
+# M: the cell ends with a match/substitution
+# X: the cell ends with a gap in observed (an expected character was consumed)
+# Y: the cell ends with a gap in expected (an observed character was consumed)
+_M, _X, _Y = 0, 1, 2
+
+
+def _encode(text: str):
+    """Code points of `text` as a uint32 array"""
+    return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+
+
+def _best(x, y, m):
+    """
+    Element-wise max of the X, Y and M candidates and the state each came from.
+    Ties are broken the same way as the python engine:
+    gap in observed, then gap in expected, then match.
+    """
+    value = np.maximum(np.maximum(x, y), m)
+    state = np.where(x == value, _X, np.where(y == value, _Y, _M)).astype(np.uint8)
+    return value, state
+
+
+def _gotoh_fill(obs, exp, scores, start_open=False, traceback=True, band=None, cutoff=None, init=None,
+                deadline=None):
+    """
+    Fill the three Gotoh matrices one row (expected character) at a time.
+
+    Scores are kept for the previous and current rows only.
+    Traceback pointers for every cell are packed into one uint8:
+    bits 0-1 hold the predecessor state of M, bits 2-3 of X, bits 4-5 of Y.
+
+    :param start_open: a gap in observed is already open before the first cell,
+                       so extending it from the corner does not pay GAP_OPEN
+    :param traceback: when False no pointers are kept (O(len(obs)) memory)
+    :param band: (low, high) limits on the diagonal j - i of the cells that are filled;
+                 row i of the pointers then starts at column _band_start(i, band)
+    :param cutoff: stop once no cell of a row can still reach this score
+                   (Ukkonen's cutoff); (None, None) is then returned
+    :param init: scores of the final row of an earlier fill against the same obs;
+                 filling continues below it (row 0 of the pointers is then unused)
+    :param deadline: raise AlignmentTimeout if a row starts after this time.monotonic() value
+    :return: the scores of the final row (3 x len(obs)+1) and the pointers (or None)
+    """
+    MATCH, SUB, OPEN, EXTEND = scores
+    n, m = len(obs), len(exp)
+    low, high = band or (-m, n)
+
+    width = min(n, high - low) + 1
+    ptrs = np.zeros((m + 1, width), dtype=np.uint8) if traceback else None
+    prev = np.full((3, n + 1), -np.inf)
+    cur = np.full((3, n + 1), -np.inf)
+
+    # Row 0: only gaps in expected
+    hi = min(n, high)
+    if init is not None:
+        cur[:] = init
+    else:
+        cur[_M, 0] = 0
+        if start_open:
+            cur[_X, 0] = 0
+        cur[_Y, 1:hi + 1] = OPEN + EXTEND * np.arange(1, hi + 1)
+        if traceback:
+            ptrs[0, 1:hi + 1] = _Y << 4
+            ptrs[0, 1:2] = _M << 4
+
+    steps = np.arange(1, width)
+    cols_left = n - np.arange(n + 1)
+    best = max(MATCH, SUB)
+    for i in range(1, m + 1):
+        # Cells outside the band stay -inf in both buffers because the band only moves right
+        check_deadline(deadline)
+        prev, cur = cur, prev
+        lo, hi = max(0, i + low), min(n, i + high)
+        first = max(lo, 1)  # first column with a diagonal predecessor
+
+        x, x_from = _best(
+            prev[_X, lo:hi + 1] + EXTEND,
+            prev[_Y, lo:hi + 1] + OPEN + EXTEND,
+            prev[_M, lo:hi + 1] + OPEN + EXTEND
+        )
+        diag, m_from = _best(prev[_X, first - 1:hi], prev[_Y, first - 1:hi], prev[_M, first - 1:hi])
+
+        cur[_X, lo:hi + 1] = x
+        cur[_M, 0] = -np.inf
+        cur[_M, first:hi + 1] = diag + np.where(obs[first - 1:hi] == exp[i - 1], MATCH, SUB)
+
+        # Y[j] = max over k <= j of (open[k] + (j - k) * EXTEND)
+        # which is a running max once the extension cost is factored out
+        k = steps[:hi - lo]
+        opened = np.maximum(cur[_M, lo:hi], cur[_X, lo:hi]) + OPEN + EXTEND
+        cur[_Y, lo] = -np.inf
+        cur[_Y, lo + 1:hi + 1] = np.maximum.accumulate(opened - k * EXTEND) + k * EXTEND
+
+        if traceback:
+            _, y_from = _best(
+                cur[_X, lo:hi] + OPEN + EXTEND,
+                cur[_Y, lo:hi] + EXTEND,
+                cur[_M, lo:hi] + OPEN + EXTEND
+            )
+            row = ptrs[i]
+            row[:hi - lo + 1] = x_from << 2
+            row[first - lo:hi - lo + 1] |= m_from
+            row[1:hi - lo + 1] |= y_from << 4
+
+        if cutoff is not None:
+            rows_left = m - i
+            left = cols_left[lo:hi + 1]
+            reachable = cur[:, lo:hi + 1].max(axis=0) \
+                + best * np.minimum(rows_left, left) + EXTEND * np.abs(rows_left - left)
+            if reachable.max() < cutoff:
+                return None, None
+
+    if band is not None:
+        cur[:, :max(0, m + low)] = -np.inf
+    return cur, ptrs
+
+
+def _band_start(i, band):
+    """Column of the first cell filled in row i"""
+    return max(0, i + band[0]) if band is not None else 0
+
+
+def _trace_rows(ptrs, state, i, j, path, band=None):
+    """
+    Walk the pointers back from cell (i, j) until row 0, appending the Gotoh states to path
+    (last step first) and returning the state and column reached in row 0
+    """
+    while i > 0:
+        p = int(ptrs[i, j - _band_start(i, band)])
+        path.append(state)
+        if state == _M:
+            state = p & 3
+            i -= 1
+            j -= 1
+        elif state == _X:
+            state = (p >> 2) & 3
+            i -= 1
+        else:
+            state = (p >> 4) & 3
+            j -= 1
+    return state, j
+
+
+def _traceback(ptrs, state, i, j, band=None):
+    """Walk the pointers back from cell (i, j) and return the Gotoh states in path order"""
+    path = []
+    _, j = _trace_rows(ptrs, state, i, j, path, band)
+    # Row 0 only has gaps in expected
+    path.extend([_Y] * j)
+    path.reverse()
+    return path
+
+
+def _path_runs(path, obs, exp):
+    """Edit script runs for a path of Gotoh states"""
+    if not path:
+        return []
+    states = np.array(path, dtype=np.uint8)
+    ops = np.where(states == _X, 3, np.where(states == _Y, 2, 0))
+
+    # Which characters does each diagonal step line up?
+    diagonal = states == _M
+    obs_index = np.cumsum(states != _X)[diagonal] - 1
+    exp_index = np.cumsum(states != _Y)[diagonal] - 1
+    ops[diagonal] = obs[obs_index] != exp[exp_index]
+
+    starts = np.flatnonzero(np.diff(ops, prepend=-1))
+    lengths = np.diff(starts, append=len(ops))
+    return [('=XID'[op], int(length)) for op, length in zip(ops[starts], lengths)]
+
+
+def _trie_size(texts: list[str]) -> int:
+    """The number of distinct prefixes of texts: the characters of their trie"""
+    texts = sorted(texts)
+    return sum(len(text) - common_prefix_length(text, before) for before, text in zip([''] + texts, texts))
+
+
+def _trie_scores(obs, exps, scores, deadline=None):
+    """Optimal alignment score of obs against each of exps, filling the rows of shared prefixes once"""
+    scored = [None] * len(exps)
+    root, _ = _gotoh_fill(obs, obs[:0], scores, traceback=False, deadline=deadline)
+
+    # Each entry is a set of alternatives that agree on their first `depth` characters,
+    # along with the final row of the fill for those characters
+    stack = [(list(range(len(exps))), 0, root)]
+    while stack:
+        group, depth, row = stack.pop()
+        first = exps[group[0]]
+        common = min(len(exps[index]) for index in group)
+        for index in group[1:]:
+            differs = np.flatnonzero(exps[index][depth:common] != first[depth:common])
+            if len(differs):
+                common = depth + int(differs[0])
+
+        if common > depth:
+            row, _ = _gotoh_fill(obs, first[depth:common], scores, traceback=False, init=row, deadline=deadline)
+
+        branches = defaultdict(list)
+        for index in group:
+            if len(exps[index]) == common:
+                score, _ = _end_scores(row, scores, False)
+                scored[index] = float(score[0])
+            else:
+                branches[int(exps[index][common])].append(index)
+        stack.extend((branch, common, row) for branch in branches.values())
+
+    return scored
+
+
+def _pattern_row(prev, spans, scores):
+    """
+    Gotoh row of a pattern below `prev`.
+    A match state at column j comes from the best span ending at j, in one step.
+    :return: the row and its pointers: for the match state the column and state it came from,
+             and the predecessor states of the X and Y states
+    """
+    MATCH, SUB, OPEN, EXTEND = scores
+    n = prev.shape[1] - 1
+    cur = np.full_like(prev, -np.inf)
+    cur[_X], x_from = _best(prev[_X] + EXTEND, prev[_Y] + OPEN + EXTEND, prev[_M] + OPEN + EXTEND)
+
+    m_start = np.zeros(n + 1, dtype=np.int64)
+    m_from = np.zeros(n + 1, dtype=np.uint8)
+    if spans:
+        starts, ends = np.array(spans, dtype=np.int64).T
+        value, state = _best(prev[_X, starts], prev[_Y, starts], prev[_M, starts])
+        # Keep only the best span ending at each column
+        order = np.lexsort((value, ends))
+        last = np.append(ends[order][1:] != ends[order][:-1], True)
+        best = order[last]
+        cur[_M, ends[best]] = value[best] + MATCH
+        m_start[ends[best]] = starts[best]
+        m_from[ends[best]] = state[best]
+
+    # The same running max as in _gotoh_fill
+    k = np.arange(1, n + 1)
+    opened = np.maximum(cur[_M, :n], cur[_X, :n]) + OPEN + EXTEND
+    cur[_Y, 1:] = np.maximum.accumulate(opened - k * EXTEND) + k * EXTEND
+    _, y_from = _best(cur[_X, :n] + OPEN + EXTEND, cur[_Y, :n] + EXTEND, cur[_M, :n] + OPEN + EXTEND)
+
+    return cur, (m_start, m_from, x_from, np.append(np.uint8(_M), y_from))
+
+
+def _segment_traceback(filled, state, j):
+    """
+    The steps of the best path through rows filled by pattern_edit_script, in path order:
+    Gotoh states for literal rows, and for each pattern the (start, end) span it matched or None
+    """
+    path = []
+    for segment, ptrs in reversed(filled):
+        if segment is None:
+            # The first row only has gaps in expected
+            path.extend([_Y] * j)
+        elif isinstance(segment, str):
+            state, j = _trace_rows(ptrs, state, len(segment), j, path)
+        else:
+            m_start, m_from, x_from, y_from = ptrs
+            while state == _Y:
+                path.append(_Y)
+                state = int(y_from[j])
+                j -= 1
+            if state == _M:
+                path.append((int(m_start[j]), j))
+                state, j = int(m_from[j]), int(m_start[j])
+            else:
+                path.append(None)
+                state = int(x_from[j])
+    path.reverse()
+    return path
+
+
+def _end_scores(last_row, scores, end_open):
+    """
+    Scores of the three states at the last cell of the final row.
+    When a gap in observed continues past the end (end_open),
+    its opening cost has already been paid by the caller.
+    """
+    end_x = last_row[_X, -1:] - (scores[2] if end_open else 0)
+    return _best(end_x, last_row[_Y, -1:], last_row[_M, -1:])
+
+
+def _full_path(obs, exp, scores, start_open=False, end_open=False, cutoff=None, traceback=True,
+               deadline=None):
+    """
+    Optimal score and path using a traceback pointer for every cell.
+    Without a traceback only the score is computed (path is None), in linear memory.
+    """
+    last_row, ptrs = _gotoh_fill(obs, exp, scores, start_open, traceback, cutoff=cutoff, deadline=deadline)
+    if last_row is None:
+        return None, None
+    score, state = _end_scores(last_row, scores, end_open)
+    path = _traceback(ptrs, int(state[0]), len(exp), len(obs)) if traceback else None
+    return float(score[0]), path
+
+
+def _hirschberg_path(obs, exp, scores, start_open=False, end_open=False, deadline=None):
+    """
+    Optimal score and path in linear memory (Myers and Miller's affine variant of Hirschberg)
+
+    The middle row of expected is scored forward from the top and backward from the bottom.
+    The best path either crosses it at some column, or runs down that column in a gap
+    spanning both halves (so its opening cost must only be counted once).
+    """
+    OPEN = scores[2]
+    n, m = len(obs), len(exp)
+    if m < 2 or (m + 1) * (n + 1) <= HIRSCHBERG_BASE_CELLS:
+        return _full_path(obs, exp, scores, start_open, end_open, deadline=deadline)
+
+    mid = m // 2
+    top, _ = _gotoh_fill(obs, exp[:mid], scores, start_open, traceback=False, deadline=deadline)
+    bottom, _ = _gotoh_fill(obs[::-1], exp[mid:][::-1], scores, end_open, traceback=False,
+                            deadline=deadline)
+    bottom = bottom[:, ::-1]
+
+    crossing = top.max(axis=0) + bottom.max(axis=0)
+    spanning = top[_X] + bottom[_X] - OPEN
+    j_cross = int(np.argmax(crossing))
+    j_span = int(np.argmax(spanning))
+
+    if spanning[j_span] > crossing[j_cross]:
+        # exp[mid - 1] and exp[mid] both fall in one gap that continues into each half
+        _, head = _hirschberg_path(obs[:j_span], exp[:mid - 1], scores, start_open, True, deadline)
+        _, tail = _hirschberg_path(obs[j_span:], exp[mid + 1:], scores, True, end_open, deadline)
+        return float(spanning[j_span]), head + [_X, _X] + tail
+
+    _, head = _hirschberg_path(obs[:j_cross], exp[:mid], scores, start_open, False, deadline)
+    _, tail = _hirschberg_path(obs[j_cross:], exp[mid:], scores, False, end_open, deadline)
+    return float(crossing[j_cross]), head + tail
+
+
+def _outside_band_bound(n, m, scores, band):
+    """
+    Upper bound on the score of any path that leaves the band.
+
+    A path reaching diagonal `high + 1` makes at least that many gaps in expected,
+    and then also `n - m` fewer gaps in observed; every remaining step is at best a match.
+    The bound is linear in the number of gaps, so it is largest at one of its extremes.
+    Below the band is symmetric.
+    """
+    MATCH, SUB, OPEN, EXTEND = scores
+    best = max(MATCH, SUB)
+    low, high = band
+    bound = -math.inf
+    if high < n:
+        for h in (high + 1, n):
+            bound = max(bound, best * (n - h) + EXTEND * (2 * h - n + m) + 2 * OPEN)
+    if low > -m:
+        for v in (1 - low, m):
+            bound = max(bound, best * (m - v) + EXTEND * (2 * v + n - m) + 2 * OPEN)
+    return bound
+
+
+def _banded_path(obs, exp, scores, max_band=None, cutoff=None, traceback=True, deadline=None):
+    """
+    Optimal score and path, filling only a band of diagonals around the main one.
+
+    The score found inside a band is a lower bound on the optimal score, so the band
+    is widened straight to the first width whose outside bound falls below it.
+    This repeats until no path outside the band can beat the best path inside it,
+    or until the band would exceed `max_band` (then the best banded path is returned).
+    With a cutoff, a path must also reach the cutoff to be worth widening for.
+    """
+    n, m = len(obs), len(exp)
+    if scores[2] > 0 or scores[3] > 0:
+        # The bound assumes gaps cost something
+        return _full_path(obs, exp, scores, cutoff=cutoff, traceback=traceback, deadline=deadline)
+
+    def capped(k):
+        return max_band is not None and k > max_band
+
+    def band_for(k):
+        low, high = max(-m, min(0, n - m) - k), min(n, max(0, n - m) + k)
+        if 2 * (high - low) >= n + m and not capped(2 * k):
+            # Most of the matrix; filling all of it costs less than another doubling
+            return -m, n
+        return low, high
+
+    k = BAND_START if max_band is None else min(BAND_START, max_band)
+    while True:
+        band = band_for(k)
+        outside = _outside_band_bound(n, m, scores, band)
+        last_row, ptrs = _gotoh_fill(obs, exp, scores, traceback=traceback, band=band, cutoff=cutoff,
+                                     deadline=deadline)
+
+        if last_row is None:
+            # Nothing inside the band reaches the cutoff
+            if outside < cutoff or capped(2 * k):
+                return None, None
+            floor = cutoff
+        else:
+            score, state = _end_scores(last_row, scores, False)
+            score = float(score[0])
+            if score >= outside or capped(2 * k):
+                path = _traceback(ptrs, int(state[0]), m, n, band) if traceback else None
+                return score, path
+            floor = score if cutoff is None else max(score, cutoff)
+
+        k *= 2
+        while floor < _outside_band_bound(n, m, scores, band_for(k)) and not capped(2 * k):
+            k *= 2
+
+
+def _numpy_align(observed, expected, MATCH, SUB, GAP_OPEN, GAP_EXTEND,
+                 mode='full', max_band=None, score_only=False, cutoff=None, deadline=None):
+    scores = (MATCH, SUB, GAP_OPEN, GAP_EXTEND)
+    obs, exp = _encode(observed), _encode(expected)
+    if mode == 'banded':
+        score, path = _banded_path(obs, exp, scores, max_band, cutoff, not score_only, deadline)
+    elif mode == 'hirschberg' and not score_only:
+        score, path = _hirschberg_path(obs, exp, scores, deadline=deadline)
+    else:
+        # Without a traceback the full mode already runs in linear memory
+        score, path = _full_path(obs, exp, scores, cutoff=cutoff, traceback=not score_only,
+                                 deadline=deadline)
+
+    if score is None or (cutoff is not None and score < cutoff):
+        return None, None
+    if score_only:
+        return score, None
+    return score, _path_runs(path, obs, exp)
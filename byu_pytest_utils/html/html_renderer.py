@@ -1,4 +1,5 @@
 import re
+from itertools import groupby
 from pathlib import Path
 from typing import Optional
 from datetime import datetime
@@ -21,6 +22,8 @@ class TestResults:
     expected: str
     output: str
     passed: bool
+    alignment: str = 'full'
+    gap: Optional[str] = None  # The gap character of observed and expected (default: the renderer's)
 
 
 class HTMLRenderer:
@@ -44,11 +47,12 @@ class HTMLRenderer:
             'COMPARISON_INFO': [
                 (
                     info.test_name.replace('_', ' ').replace('-', ' ').title(),
-                    *self._build_comparison_strings(info.observed, info.expected, gap),
+                    *self._build_comparison_strings(info.observed, info.expected, info.gap or gap),
                     info.output,
                     info.score,
                     info.max_score,
                     'passed' if info.passed else 'failed',
+                    self._alignment_note(info.alignment),
                 )
                 for info in test_results
             ],
@@ -119,26 +123,51 @@ class HTMLRenderer:
                     max_score=result.get('max_score', 0),
                     observed=result.get('observed', ''),
                     expected=result.get('expected', ''),
-                    passed=result.get('passed', False)
+                    passed=result.get('passed', False),
+                    alignment=result.get('alignment', 'full'),
+                    gap=result.get('gap')
                 ))
 
         return comparison_info
 
+    @staticmethod
+    def _alignment_note(alignment: str) -> str:
+        """Explain a comparison that had to be approximated to stay within its time budget."""
+        if alignment == 'full':
+            return ''
+        if alignment == 'literal':
+            return 'The patterns of this comparison were compared as plain text ' \
+                   'because matching them took too long.'
+        return f'This comparison was approximated ({alignment} alignment) ' \
+               f'because the full comparison took too long.'
+
     @staticmethod
     def _build_comparison_strings(obs: str, exp: str, gap: str) -> tuple[str, str]:
         """Return observed and expected strings with HTML span highlighting."""
-        observed, expected = '', ''
+        observed, expected = [], []
 
-        for o, e in zip(obs, exp):
+        def kind(pair):
+            o, e = pair
             if o == e:
-                observed += o
-                expected += e
+                return 'same'
             elif o == gap:
-                expected += f'<span style="background-color: {RED}">{e}</span>'
+                return 'missing'
             elif e == gap:
-                observed += f'<span style="background-color: {GREEN}">{o}</span>'
+                return 'extra'
+            return 'changed'
+
+        # Highlight each run of same-kind characters with a single span
+        for run_kind, pairs in groupby(zip(obs, exp), key=kind):
+            o_run, e_run = (''.join(chars) for chars in zip(*pairs))
+            if run_kind == 'same':
+                observed.append(o_run)
+                expected.append(e_run)
+            elif run_kind == 'missing':
+                expected.append(f'<span style="background-color: {RED}">{e_run}</span>')
+            elif run_kind == 'extra':
+                observed.append(f'<span style="background-color: {GREEN}">{o_run}</span>')
             else:
-                observed += f'<span style="background-color: {BLUE}">{o}</span>'
-                expected += f'<span style="background-color: {BLUE}">{e}</span>'
+                observed.append(f'<span style="background-color: {BLUE}">{o_run}</span>')
+                expected.append(f'<span style="background-color: {BLUE}">{e_run}</span>')
 
-        return observed, expected
+        return ''.join(observed), ''.join(expected)
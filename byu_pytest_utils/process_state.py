@@ -0,0 +1,76 @@
+import os
+import platform
+
+# Syscall numbers of read, pread64 and readv, as /proc/<pid>/syscall shows them
+READ_SYSCALLS = {
+    'x86_64': {0, 17, 19},
+    'aarch64': {63, 65, 67},
+}
+
+
+def _tasks(pid: int) -> list[tuple[int, str]]:
+    # (pid, thread id) of every thread of the process and its descendants
+    tasks = []
+    pending = [pid]
+    seen = set()
+    while pending:
+        process = pending.pop()
+        if process in seen:
+            continue
+        seen.add(process)
+        try:
+            threads = os.listdir(f'/proc/{process}/task')
+        except OSError:
+            continue  # Already exited
+        for thread in threads:
+            tasks.append((process, thread))
+            try:
+                with open(f'/proc/{process}/task/{thread}/children') as file:
+                    pending.extend(int(child) for child in file.read().split())
+            except OSError:
+                pass
+    return tasks
+
+
+def _thread_state(process: int, thread: str) -> str:
+    # The one-letter state that follows the (command name) in stat
+    with open(f'/proc/{process}/task/{thread}/stat') as file:
+        stat = file.read()
+    return stat[stat.rindex(')') + 2]
+
+
+def stdin_waiter(pid: int):
+    """
+    A function telling whether process `pid` is blocked reading its stdin (a pipe or terminal),
+    or None when that cannot be told on this system (it needs Linux's /proc)
+
+    The program counts as blocked when one of its threads, or of its descendants',
+    is inside a read of it and none of them is running.
+    """
+    syscalls = READ_SYSCALLS.get(platform.machine())
+    if syscalls is None:
+        return None
+    try:
+        stdin = os.readlink(f'/proc/{pid}/fd/0')
+        with open(f'/proc/{pid}/syscall') as file:
+            file.read()
+    except OSError:
+        return None  # No /proc, or not allowed to inspect the process
+
+    def waiting() -> bool:
+        blocked = False
+        for process, thread in _tasks(pid):
+            try:
+                if _thread_state(process, thread) == 'R':
+                    return False
+                with open(f'/proc/{process}/task/{thread}/syscall') as file:
+                    fields = file.read().split()
+                # 'running', or the syscall number followed by its arguments
+                if int(fields[0]) in syscalls \
+                        and os.readlink(f'/proc/{process}/fd/{int(fields[1], 16)}') == stdin:
+                    blocked = True
+            except (OSError, ValueError, IndexError):
+                continue  # Exited, or not in a syscall
+        return blocked
+
+    return waiting
@@ -100,7 +100,9 @@ def parse_info(all_tests):
                 observed=group_stats.get('observed', ''),
                 expected=group_stats.get('expected', ''),
                 output=s.longreprtext,
-                passed=s.passed
+                passed=s.passed,
+                alignment=group_stats.get('alignment', 'full'),
+                gap=group_stats.get('gap')
             )
         )
 
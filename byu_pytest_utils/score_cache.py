@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import tempfile
+import warnings
+from pathlib import Path
+
+# Set this environment variable to a directory to cache scored outputs there
+CACHE_DIR_VARIABLE = 'BYU_PYTEST_UTILS_CACHE'
+# and optionally this one to the most bytes the cache may take (default 64 MB)
+CACHE_SIZE_VARIABLE = 'BYU_PYTEST_UTILS_CACHE_SIZE'
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+# Bump when scoring changes, so entries from older versions are no longer found
+CACHE_VERSION = 2
+
+
+class ScoreCache:
+    """
+    JSON values stored on disk under a hash of everything that determines them
+
+    Each entry is its own file, written to a temporary file and then renamed
+    into place, so concurrent pytest processes never read a partial entry.
+    Reading an entry updates its modification time; once the entries take more
+    than `max_bytes` the least recently used ones are deleted.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = DEFAULT_CACHE_SIZE):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Hash of the (JSON-serializable) parts"""
+        return hashlib.sha256(json.dumps([CACHE_VERSION, *parts]).encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f'{key}.json'
+
+    def get(self, key: str):
+        """The value stored under `key`, or None"""
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as file:
+                value = json.load(file)
+        except (OSError, ValueError):
+            # Missing, just evicted, or unreadable: all the same as a miss
+            return None
+
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            pass
+        return value
+
+    def put(self, key: str, value):
+        """Store `value` under `key`; failing to write only warns"""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                    json.dump(value, file)
+                os.replace(temp_path, self._path(key))
+            except BaseException:
+                Path(temp_path).unlink(missing_ok=True)
+                raise
+            self._evict()
+        except OSError as ex:
+            warnings.warn(f'Could not write to the score cache in {self.directory}: {ex}')
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # Evicted by another process
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            Path(path).unlink(missing_ok=True)
+            total -= size
+
+
+def score_cache() -> ScoreCache:
+    """The cache configured by the environment, or None when caching is off"""
+    directory = os.getenv(CACHE_DIR_VARIABLE)
+    if not directory:
+        return None
+    return ScoreCache(Path(directory), int(os.getenv(CACHE_SIZE_VARIABLE, DEFAULT_CACHE_SIZE)))
@@ -8,9 +8,7 @@ import sys
 
 sys.path.append(str(Path(__file__).parent.parent.absolute()))
 print(sys.path)
-from byu_pytest_utils.edit_dist import edit_dist
-
-GAP = '~'
+from byu_pytest_utils.edit_dist import edit_script
 
 
 def format_record(block_pos, block_type, block):
@@ -22,9 +20,9 @@ def sanitize(text):
 
 
 def generate_diff_records(last_content, content):
-    score, last_align, cur_align = edit_dist(
+    score, script = edit_script(
         last_content, content,
-        GAP=GAP, SUB=-math.inf,
+        SUB=-math.inf,
     )
     # last: def first~~~~():\n
     # cur:  def ~~~~~main():\n
@@ -33,47 +31,20 @@ def generate_diff_records(last_content, content):
     # 4+main
 
     records = []
-    block = []
-    block_type = ''
-    block_pos = 0
-
     pos = 0
-    for la, ca in zip(last_align, cur_align):
-        if la == ca:
-            if block:
-                records.append(format_record(block_pos, block_type, block))
-                block = []
-                block_type = ''
-                block_pos = 0
-            pos += 1
+    for op, last_text, cur_text in script.segments():
+        if op == '=':
+            pos += len(cur_text)
             continue
 
-        if la == GAP:  # insertion
-            if not block_type:
-                block_type = '+'
-                block_pos = pos
-            elif block_type == '-':  # just finished a deletion
-                records.append(format_record(block_pos, block_type, block))
-                block = []
-                block_type = '+'
-                block_pos = pos
-            block.append(ca)
-            pos += 1
-
-        elif ca == GAP:  # deletion
-            if not block_type:
-                block_type = '-'
-                block_pos = pos
-            elif block_type == '+':  # just finished an insertion
-                records.append(format_record(block_pos, block_type, block))
-                block = []
-                block_type = '-'
-                block_pos = pos
-            block.append(la)
+        if last_text:  # deletion
+            records.append(format_record(pos, '-', last_text))
             # don't increment pos for deletion
 
-    if block:
-        records.append(format_record(block_pos, block_type, block))
+        if cur_text:  # insertion
+            records.append(format_record(pos, '+', cur_text))
+            pos += len(cur_text)
+
     return records
 
 
@@ -0,0 +1,6 @@
+import importlib
+
+# The package exports functions named `dialog` and `edit_dist`, which shadow
+# the modules of the same name as attributes of byu_pytest_utils
+dialog_module = importlib.import_module('byu_pytest_utils.dialog')
+edit_dist_module = importlib.import_module('byu_pytest_utils.edit_dist')
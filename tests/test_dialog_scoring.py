@@ -0,0 +1,271 @@
+import time
+
+import pytest
+
+from byu_pytest_utils.dialog import _score_observed_output
+from conftest import dialog_module
+
+EXPECTED = '''My args are ['script.py', 'woot']
+Number: ``7;seven;30``
+The number is ``7;seven-again;20``
+Another number is 234
+'''
+
+OBSERVED = '''My args are ['script.py', 'woot']
+Number: 7
+The number is 8
+Another number is 23
+'''
+
+
+def test_large_alignments_switch_to_hirschberg():
+    pytest.importorskip('numpy')
+    assert _score_observed_output(EXPECTED, OBSERVED, cell_limit=0) == _score_observed_output(EXPECTED, OBSERVED)
+
+
+def test_line_level_alignment_keeps_group_attribution(monkeypatch):
+    steps = ''.join(f'Step {i}: position {i * 7 % 13}\n' for i in range(100))
+    expected = steps + EXPECTED + steps
+    observed = steps + OBSERVED + steps.replace('position 3', 'position 4')
+    by_lines = _score_observed_output(expected, observed)
+    monkeypatch.setattr(dialog_module, 'LINE_ALIGNMENT_THRESHOLD', len(expected) + len(observed))
+    by_chars = _score_observed_output(expected, observed)
+    assert by_lines == by_chars
+
+
+def test_exact_output_passes_every_group():
+    observed = EXPECTED.replace('``7;seven;30``', '7').replace('``7;seven-again;20``', '7')
+    stats = _score_observed_output(EXPECTED, observed)
+    assert all(group['passed'] for group in stats.values())
+    assert sum(group['score'] for group in stats.values()) == 1
+
+
+def test_gap_character_in_output_is_scored_like_any_other():
+    expected = 'Pick a path ~/home or ~/tmp\n'
+    observed = 'Pick a path ~/home or /tmp\n'
+    stats = _score_observed_output(expected, observed)
+    assert 0 < stats[dialog_module.DEFAULT_GROUP_NAME]['score'] < 1
+
+
+def test_missing_gap_character_shows_as_a_difference():
+    stats = dialog_module._score_output('cd ~/x\n', 'cd /x\n', [])
+    output = stats['stdout']
+    assert not output['passed']
+    assert output['gap'] != '~'
+    assert output['observed'] != output['expected']
+
+    check = dialog_module._make_group_stats_decorator(stats)(lambda: None)
+    with pytest.raises(AssertionError):
+        check('stdout')
+
+
+def test_alignment_degrades_when_out_of_time():
+    stats = _score_observed_output(EXPECTED, OBSERVED)
+    assert {group['alignment'] for group in stats.values()} == {'full'}
+
+    # With no time at all, only the step that never checks the clock can finish
+    stats = _score_observed_output(EXPECTED, OBSERVED, time_budget=0)
+    assert {group['alignment'] for group in stats.values()} == {'prefix'}
+    assert stats[dialog_module.DEFAULT_GROUP_NAME]['observed'].replace('~', '').rstrip(' ') == OBSERVED
+
+
+def test_line_matching_stays_within_the_time_budget():
+    lines = [f'{i * 7919 % 5}{i * 104729 % 3}\n' for i in range(20_000)]
+    observed = ''.join(lines)
+    expected = ''.join(reversed(lines))
+    start = time.monotonic()
+    dialog_module._budgeted_alignment(observed, expected, time_budget=1)
+    assert time.monotonic() - start < 5
+
+
+def test_line_matching_is_shared_by_the_alignment_steps(monkeypatch):
+    calls = []
+    line_matching = dialog_module._line_matching
+
+    def count_calls(*args):
+        calls.append(args)
+        return line_matching(*args)
+
+    def out_of_time(*args, **kwargs):
+        raise dialog_module.AlignmentTimeout()
+
+    monkeypatch.setattr(dialog_module, '_line_matching', count_calls)
+    monkeypatch.setattr(dialog_module, '_align_chars', out_of_time)
+    monkeypatch.setattr(dialog_module, '_align_banded', out_of_time)
+    observed = OBSERVED * 200
+    _, step = dialog_module._budgeted_alignment(observed, EXPECTED * 200)
+    assert step == 'lines'
+    assert len(calls) == 1
+
+
+def test_line_matching_matches_repeated_lines_between_unique_ones():
+    observed = ['header\n', '-\n', '-\n', 'a\n', '-\n', 'footer\n']
+    expected = ['header\n', '-\n', 'b\n', '-\n', '-\n', 'footer\n']
+    assert dialog_module._match_lines(observed, expected) == [(0, 0, 2), (2, 3, 1), (4, 4, 2), (6, 6, 0)]
+
+
+def test_prefix_alignment():
+    script = dialog_module._align_prefix('Number: 7\nabc', 'Number: 8\nab')
+    assert script.runs == [('=', 8), ('X', 4), ('I', 1)]
+
+
+def test_token_granularity_gives_no_credit_for_partial_words():
+    expected = 'The answer is ``seven;answer;50``\n'
+    observed = 'The answer is sevn\n'
+    chars = _score_observed_output(expected, observed)
+    tokens = _score_observed_output(expected, observed, granularity='tokens')
+    assert chars['answer']['score'] > 0
+    assert tokens['answer']['score'] == 0
+    assert tokens['answer']['observed'].replace('~', '') == 'sevn'
+
+    # A dialog file can ask for tokens itself
+    assert _score_observed_output('#!tokens\n' + expected, observed) == tokens
+
+
+def test_token_granularity_matches_exact_output():
+    expected = 'one  two\tthree\n``four;last;10``\n'
+    stats = _score_observed_output(expected, 'one  two\tthree\nfour\n', granularity='tokens')
+    assert all(group['passed'] for group in stats.values())
+
+
+def test_patterns_match_variable_output():
+    pytest.importorskip('numpy')
+    expected = 'Started at {{re:\\d\\d:\\d\\d}}\nPi is ``{{num:3.1416+-0.001}};pi;40``\n'
+    stats = _score_observed_output(expected, 'Started at 09:41\nPi is 3.14159\n')
+    assert all(group['passed'] for group in stats.values())
+    assert stats['pi']['expected'] == '3.14159'
+
+    stats = _score_observed_output(expected, 'Started at 09:41\nPi is 3.15\n')
+    assert stats['pi']['score'] == 0
+    assert stats['pi']['expected'] == '{{num:3.1416+-0.001}}'
+
+
+def test_patterns_may_end_with_braces():
+    pytest.importorskip('numpy')
+    stats = _score_observed_output('Year: {{re:\\d{4}}}\n', 'Year: 2024\n')
+    assert stats[dialog_module.DEFAULT_GROUP_NAME]['passed']
+
+    for broken in ('Year: {{re:\\d{4}}\n', 'Year: {{re:[0-9}}\n', 'Year: {{num:twenty}}\n'):
+        with pytest.raises(ValueError):
+            _score_observed_output(broken, 'Year: 2024\n')
+
+
+def test_number_patterns_only_match_whole_numbers():
+    pytest.importorskip('numpy')
+    expected = 'Total: ``{{num:5}};total;50``\n'
+    assert _score_observed_output(expected, 'Total: 5\n')['total']['passed']
+    for observed in ('Total: 15\n', 'Total: 105\n', 'Total: -5\n', 'Total: 5.5\n'):
+        assert not _score_observed_output(expected, observed)['total']['passed'], observed
+
+
+def test_patterns_need_numpy(monkeypatch):
+    monkeypatch.setattr(dialog_module, 'np', None)
+    with pytest.raises(ImportError):
+        _score_observed_output('Started at {{re:\\d\\d:\\d\\d}}\n', 'Started at 09:41\n')
+
+
+def test_patterns_too_large_to_align_are_compared_as_text():
+    pytest.importorskip('numpy')
+    expected = 'Started at {{re:\\d\\d:\\d\\d}}\n'
+    observed = 'Started at 09:41\n'
+    assert dialog_module._align_patterns(observed, expected, '.' * len(expected), cell_limit=100) is None
+    stats = _score_observed_output(expected, observed, cell_limit=100)
+    assert not stats[dialog_module.DEFAULT_GROUP_NAME]['passed']
+    assert stats[dialog_module.DEFAULT_GROUP_NAME]['alignment'] == 'literal'
+    assert stats[dialog_module.DEFAULT_GROUP_NAME]['expected'].startswith(expected)
+
+
+def test_choosing_an_alternative_stays_within_the_time_budget():
+    lines = [f'Line {i * 7919 % 1000}\n' for i in range(1000)]
+    alternatives = [''.join(lines), ''.join(reversed(lines))]
+    observed = ''.join(lines[::2]) * 3
+    start = time.monotonic()
+    dialog_module._score_alternatives(alternatives, observed, time_budget=1)
+    assert time.monotonic() - start < 5
+
+
+def test_dialog_compiles_in_one_pass():
+    dialog = dialog_module._compile_dialog('#!tokens\nNumber: ``<<7>>;seven;30`` and <<8>>\n')
+    assert dialog.inputs == ('7', '8')
+    assert dialog.expected == 'Number: 7 and 8\n'
+    assert dialog.group_sequence == '........a.......'
+    assert dialog.group_weights == {'.': 70, 'a': 30}
+    assert dialog.group_names == {'.': 'everything-else', 'a': 'seven'}
+    assert dialog.granularity == 'tokens'
+
+    # Expected files have no inputs
+    assert dialog_module._compile_dialog('<<7>>', with_inputs=False).expected == '<<7>>'
+
+    with pytest.raises(Exception, match='add up to 100'):
+        dialog_module._compile_dialog('``a;a;60`` ``b;b;60``')
+
+
+def test_dialog_files_are_parsed_once_per_version(tmp_path, monkeypatch):
+    dialog_file = tmp_path / 'dialog.txt'
+    dialog_file.write_text('Number: <<7>>\n')
+    compiled = []
+    compile_dialog = dialog_module._compile_dialog
+    monkeypatch.setattr(dialog_module, '_compile_dialog',
+                        lambda *args: compiled.append(args) or compile_dialog(*args))
+
+    first = dialog_module._load_dialog(dialog_file)
+    assert dialog_module._load_dialog(dialog_file) is first
+    assert len(compiled) == 1
+
+    dialog_file.write_text('Number: <<8>>\n')
+    assert dialog_module._load_dialog(dialog_file).inputs == ('8',)
+    assert len(compiled) == 2
+
+
+def test_vectorized_group_aggregation_matches_the_python_walk(monkeypatch):
+    pytest.importorskip('numpy')
+    from byu_pytest_utils.edit_dist import edit_script
+    dialog = dialog_module._compile_dialog(EXPECTED)
+    _, script = edit_script(OBSERVED + 'extra\n', dialog.expected)
+    vectorized = dialog_module._aggregate_groups(script, dialog.group_sequence)
+    monkeypatch.setattr(dialog_module, 'np', None)
+    walked = dialog_module._aggregate_groups(script, dialog.group_sequence)
+    assert [dict(totals) for totals in vectorized] == [dict(totals) for totals in walked]
+
+
+def test_group_stats_build_their_text_on_demand():
+    stats = _score_observed_output(EXPECTED, OBSERVED)
+    seven = stats['seven']
+    assert isinstance(seven, dialog_module.GroupStats)
+    assert not hasattr(seven, '__dict__')
+    assert seven['observed'] == '7' and seven['expected'] == '7'
+    assert set(seven) == {'group_name', 'expected', 'observed', 'gap', 'score', 'max_score', 'passed',
+                         'alignment'}
+
+    # The plugin scales the scores in place
+    seven['max_score'] *= 10
+    assert seven['max_score'] == pytest.approx(3)
+    with pytest.raises(KeyError):
+        seven['observed'] = 'changed'
+
+    consolidated = dialog_module._consolidate_stats('stdout', stats)
+    assert consolidated['name'] == 'stdout'
+    assert consolidated['observed'] == stats[dialog_module.DEFAULT_GROUP_NAME]['observed']
+    assert consolidated.source is stats[dialog_module.DEFAULT_GROUP_NAME].source
+
+
+def test_identical_expected_files_are_not_aligned(tmp_path, monkeypatch):
+    expected_file = tmp_path / 'expected.txt'
+    observed_file = tmp_path / 'observed.txt'
+    expected_file.write_text(OBSERVED * 10)
+    observed_file.write_text(OBSERVED * 10)
+    aligned = dialog_module._score_output(None, '', [(expected_file, observed_file)])
+
+    def no_alignment(*args, **kwargs):
+        raise AssertionError('identical files should not be aligned')
+
+    monkeypatch.setattr(dialog_module, '_budgeted_alignment', no_alignment)
+    monkeypatch.setattr(dialog_module, 'FILE_COMPARE_CHUNK', 7)
+    stats = dialog_module._score_output(None, '', [(expected_file, observed_file)])
+    assert stats == aligned
+    assert stats['expected.txt']['passed']
+
+    # A difference anywhere means aligning after all
+    observed_file.write_text(OBSERVED * 9 + OBSERVED.replace('23', '24'))
+    with pytest.raises(AssertionError, match='should not be aligned'):
+        dialog_module._score_output(None, '', [(expected_file, observed_file)])
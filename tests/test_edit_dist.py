@@ -0,0 +1,158 @@
+import random
+
+import pytest
+
+from byu_pytest_utils.edit_dist import best_alternative, edit_dist, edit_dist_many, edit_script, tokenize
+from conftest import edit_dist_module
+
+pytest.importorskip('numpy')
+
+
+def _aligned_score(obs, exp, MATCH=1, SUB=-1, GAP_OPEN=-3, GAP_EXTEND=-1):
+    # The score of two gap-padded aligned strings, column by column
+    score = 0
+    previous = None
+    for o, e in zip(obs, exp):
+        column = 'I' if e == '~' else 'D' if o == '~' else 'M'
+        if column == 'M':
+            score += MATCH if o == e else SUB
+        else:
+            score += GAP_EXTEND + (GAP_OPEN if column != previous else 0)
+        previous = column
+    return score
+
+
+def test_numpy_engine_is_at_least_as_good_as_python_engine():
+    for observed, expected in [
+        ('hello world', 'hallo wrld'),
+        ('Number: 7\nThe number is 7\n', 'Number: 7\nThe banana is 7\n'),
+        ('abc', ''),
+        ('', 'abc'),
+        ('', ''),
+    ]:
+        score, obs, exp = edit_dist(observed, expected, engine='numpy')
+        py_score, py_obs, py_exp = edit_dist(observed, expected, engine='python')
+        assert score == py_score
+        assert (obs, exp) == (py_obs, py_exp)
+
+    # The python engine can miss the best alignment; the numpy engine never scores lower,
+    # and its aligned strings are the observed and expected text and add up to its score
+    rng = random.Random(1)
+    pieces = ['a', 'b', 'c', 'x', '7', '\n', 'abc', 'The number is ']
+    for _ in range(300):
+        observed = ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 8)))
+        expected = ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 8)))
+        score, obs, exp = edit_dist(observed, expected, engine='numpy')
+        py_score, _, _ = edit_dist(observed, expected, engine='python')
+        assert score >= py_score
+        assert len(obs) == len(exp)
+        assert obs.replace('~', '') == observed and exp.replace('~', '') == expected
+        assert _aligned_score(obs, exp) == score
+
+    assert edit_dist('abcThe number is \nabc', '7abcabcx', engine='numpy')[0] == -20.0
+    assert edit_dist('abcThe number is \nabc', '7abcabcx', engine='python')[0] == -22
+
+
+def test_numpy_engine_aligned_strings_round_trip():
+    observed = 'The quick brown fox\njumps over\n'
+    expected = 'The quick brown dog\njumped over\nthe lazy dog\n'
+    score, obs, exp = edit_dist(observed, expected, engine='numpy')
+    assert len(obs) == len(exp)
+    assert obs.replace('~', '') == observed
+    assert exp.replace('~', '') == expected
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        edit_dist('a', 'b', engine='fortran')
+
+
+def test_hirschberg_mode_matches_full_mode():
+    observed = 'Number: 7\nThe number is 7\nAnother number is 8\n' * 20
+    expected = 'Number: 7\nThe banana is 7\nAnother number is 234\n' * 20
+    score, obs, exp = edit_dist(observed, expected, mode='full', anchor=False)
+    hb_score, hb_obs, hb_exp = edit_dist(observed, expected, mode='hirschberg', anchor=False)
+    assert hb_score == score
+    assert hb_obs.replace('~', '') == observed
+    assert hb_exp.replace('~', '') == expected
+
+
+def test_banded_mode_matches_full_mode():
+    expected = ''.join(f'Step {i}: position {i * 7 % 13}\n' for i in range(200))
+    observed = expected[:1500] + 'oops, an extra line\n' + expected[1500:].replace('position 3', 'position 4')
+    score, obs, exp = edit_dist(observed, expected, mode='full', anchor=False)
+    banded_score, banded_obs, banded_exp = edit_dist(observed, expected, mode='banded', anchor=False)
+    assert banded_score == score
+    assert banded_obs.replace('~', '') == observed
+    assert banded_exp.replace('~', '') == expected
+
+
+def test_banded_mode_with_max_band_still_aligns_everything():
+    observed = 'x' * 300 + 'hello'
+    expected = 'hello'
+    score, obs, exp = edit_dist(observed, expected, mode='banded', max_band=8, anchor=False)
+    assert obs.replace('~', '') == observed
+    assert exp.replace('~', '') == expected
+
+
+def test_anchoring_trims_and_splits_at_unique_lines(monkeypatch):
+    monkeypatch.setattr(edit_dist_module, 'ANCHOR_MIN_CELLS', 0)
+    expected = ''.join(f'Step {i}: position {i * 7 % 13}\n' for i in range(200))
+    observed = expected.replace('Step 50:', 'Step 5O:').replace('Step 150:', 'Stop 150:') + '!'
+    score, obs, exp = edit_dist(observed, expected)
+    assert obs.replace('~', '') == observed
+    assert exp.replace('~', '') == expected
+    assert score == edit_dist(observed, expected, anchor=False)[0]
+
+
+def test_edit_dist_many_only_aligns_outputs_that_differ():
+    expected = 'Number: 7\nThe number is 7\n'
+    observed = [expected, 'Number: 7\nThe numbr is 7\n', 'Number: 8\nThe number is 8\n\n', '']
+    results = edit_dist_many(observed, expected)
+    assert [distance for distance, _ in results] == [0, 1, 3, len(expected)]
+    assert results[0][1] is None
+    assert results[1][1] == edit_dist(observed[1], expected)
+
+
+def test_score_only_and_cutoff():
+    observed = 'Number: 7\nThe numbr is 7\n'
+    expected = 'Number: 7\nThe number is 7\n'
+    score, _, _ = edit_dist(observed, expected)
+    for mode in ('full', 'banded', 'hirschberg'):
+        assert edit_dist(observed, expected, mode=mode, score_only=True) == (score, None, None)
+        assert edit_dist(observed, expected, mode=mode, cutoff=score)[0] == score
+        assert edit_dist(observed, expected, mode=mode, cutoff=score + 1) == (None, None, None)
+
+
+def test_edit_script_runs_and_segments():
+    score, script = edit_script('ab~dxf', 'abcdyf')
+    assert score == edit_dist('ab~dxf', 'abcdyf')[0]
+    assert ''.join(obs for _, obs, _ in script.segments()) == 'ab~dxf'
+    assert ''.join(exp for _, _, exp in script.segments()) == 'abcdyf'
+    assert all(count > 0 for _, count in script.runs)
+    assert all(a[0] != b[0] for a, b in zip(script.runs, script.runs[1:]))
+    obs, exp = script.aligned(gap='#')
+    assert (obs.replace('#', ''), exp.replace('#', '')) == ('ab~dxf', 'abcdyf')
+
+
+def test_tokenize_round_trips():
+    text = '  Hello,  world!\n\tbye '
+    assert ''.join(tokenize(text)) == text
+    assert tokenize(text) == ['  ', 'Hello,', '  ', 'world!', '\n\t', 'bye', ' ']
+
+
+def test_best_alternative_matches_scoring_each_alternative():
+    observed = 'Sorted: 1 2 3\nTies: b a\n'
+    alternatives = ['Sorted: 1 2 3\nTies: a b\n', 'Sorted: 1 2 3\nTies: b a\n', 'Sorted: 3 2 1\n']
+    index, score = best_alternative(observed, alternatives)
+    assert index == 1
+    assert score == max(edit_script(observed, expected, score_only=True)[0] for expected in alternatives)
+    assert best_alternative(observed, alternatives[:1] * 2) == (0, edit_script(observed, alternatives[0])[0])
+
+
+def test_best_alternative_ranks_by_distance_when_too_large_or_slow():
+    observed = 'Sorted: 1 2 3\nTies: b a\n'
+    alternatives = ['Sorted: 1 2 3\nTies: a b\n', 'Sorted: 1 2 3\nTies: b a\n', 'Sorted: 3 2 1\n']
+    assert best_alternative(observed, alternatives, max_cells=0) == (1, 0)
+    assert best_alternative(observed, alternatives, deadline=0) == (1, 0)
+    assert best_alternative(observed, alternatives[::2], max_cells=0) == (0, -2)
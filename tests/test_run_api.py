@@ -1,4 +1,14 @@
-from byu_pytest_utils import run_exec, max_score, test_files
+import asyncio
+import codecs
+import platform
+import sys
+import time
+
+import pytest
+
+from byu_pytest_utils import run_exec, max_score, score_outputs, test_files, run_exec_async, run_script_async, \
+    run_many
+from conftest import dialog_module
 
 
 def test_run_exec():
@@ -17,6 +27,126 @@ def test_run_exec_with_failed_test():
     assert not stats['stdout']['passed']
 
 
+def test_score_outputs_groups_identical_outputs():
+    passing = "My args are ['script_for_dialog_passes.py', 'woot', '7']\n" \
+              "Number: 7\nThe number is 7\nNumber: 8\nAnother number is 8\n"
+    failing = passing.replace('is 7', 'is 3')
+    results, clusters = score_outputs(
+        {'a': passing, 'b': failing, 'c': passing},
+        expected_stdio=test_files / "test_dialog_should_pass.txt"
+    )
+    assert list(results) == ['a', 'b', 'c']
+    assert results['a'] == results['c']
+    assert results['a'] is not results['c']
+    assert results['a']['stdout']['passed'] and not results['b']['stdout']['passed']
+    assert [(cluster['size'], cluster['submissions'], cluster['passed']) for cluster in clusters] \
+           == [(2, ['a', 'c'], True), (1, ['b'], False)]
+
+
+def test_run_exec_with_alternative_dialogs(tmp_path):
+    alternative = tmp_path / 'alternative.txt'
+    alternative.write_text(
+        (test_files / "test_dialog_should_pass.txt").read_text().replace('``7;seven;40``', 'seven')
+    )
+    stats = run_exec("python3", "script_for_dialog_passes.py", 'woot', 7,
+                     expected_stdio=[alternative, test_files / "test_dialog_should_pass.txt"])
+    assert stats['stdout']['passed']
+    assert stats['stdout']['alternative'] == 1
+
+
+def test_pump_stream_decodes_characters_split_between_reads():
+    async def read():
+        stream = asyncio.StreamReader()
+        texts = []
+        pump = asyncio.create_task(
+            dialog_module._pump_stream(stream, codecs.getincrementaldecoder('utf-8')(), texts.append))
+        encoded = 'héllo ✓\n'.encode()
+        stream.feed_data(encoded[:2])
+        await asyncio.sleep(0.05)
+        stream.feed_data(encoded[2:])
+        stream.feed_eof()
+        await pump
+        return texts
+
+    assert asyncio.run(read()) == ['h', 'éllo ✓\n']
+
+
+def test_run_exec_reads_large_output_without_echo(capsys):
+    output = dialog_module._run_exec('python3', '-c', "print('é' * 5000)", echo_output=False)
+    assert output == 'é' * 5000 + '\n'
+    assert capsys.readouterr().out == ''
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux') or platform.machine() not in ('x86_64', 'aarch64'),
+                    reason='needs /proc to see the program waiting for input')
+def test_run_exec_sends_input_once_the_program_waits_for_it():
+    start = time.monotonic()
+    stats = run_exec("python3", "script_for_dialog_passes.py", 'woot', 7,
+                     expected_stdio=test_files / "test_dialog_should_pass.txt",
+                     read_timeout=5)
+    assert stats['stdout']['passed']
+    # Each of the 3 reads would otherwise wait out the 5 seconds
+    assert time.monotonic() - start < 5
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='pseudo-terminals are Unix only')
+def test_run_exec_on_a_pty_gives_the_same_transcript():
+    args = ("python3", "script_for_dialog_passes.py", 'woot', 7)
+    piped = dialog_module._run_exec(*args, inputs=['7', '8'], echo_output=False)
+    on_pty = dialog_module._run_exec(*args, inputs=['7', '8'], echo_output=False, pty=True)
+    assert on_pty == piped
+
+    program = "import os, sys; print(os.isatty(1)); print(sys.stdin.read().upper(), end='')"
+    output = dialog_module._run_exec('python3', '-c', program, inputs=['a', 'b'], echo_output=False, pty=True)
+    assert output == 'True\na\nb\nA\nB\n'
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='pseudo-terminals are Unix only')
+def test_run_exec_on_a_pty_passes_control_characters_or_refuses_the_input():
+    program = "import sys; print(repr(sys.stdin.read()))"
+    control = ['a\x03b\x1a\x13\rc']
+    piped = dialog_module._run_exec('python3', '-c', program, inputs=control, echo_output=False)
+    on_pty = dialog_module._run_exec('python3', '-c', program, inputs=control, echo_output=False, pty=True)
+    assert on_pty == piped
+
+    # A terminal would cut the line short, or erase part of it
+    for inputs in (['x' * dialog_module.PTY_MAX_LINE], ['ab\x7fc']):
+        with pytest.raises(ValueError):
+            dialog_module._run_exec('python3', '-c', program, inputs=inputs, echo_output=False, pty=True)
+
+
+def test_run_exec_reads_output_while_writing_large_input():
+    # Echoes its input as it reads it, so more than a pipe buffer is in flight both ways
+    program = 'import sys\n' \
+              'while data := sys.stdin.read(4096):\n' \
+              '    sys.stdout.write(data)\n' \
+              '    sys.stdout.flush()\n'
+    content = 'x' * 500_000 + '\n'
+    start = time.monotonic()
+    output, error = asyncio.run(dialog_module._run_exec_with_io(
+        ['python3', '-c', program], [content], read_timeout=5, finish_timeout=30,
+        max_output_size=2_000_000, echo_output=False
+    ))
+    assert (output, error) == (content * 2, '')
+    assert time.monotonic() - start < 5
+
+
+def test_run_many_runs_dialogs_concurrently():
+    dialog = test_files / "test_dialog_should_pass.txt"
+    start = time.monotonic()
+    results = run_many([
+        *(run_exec_async("python3", "-c", "import time; time.sleep(1)", echo_output=False) for _ in range(3)),
+        run_exec_async("python3", "script_for_dialog_passes.py", 'woot', 7, expected_stdio=dialog,
+                       echo_output=False),
+        run_script_async("script_for_dialog_passes.py", 'woot', 7, expected_stdio=dialog, echo_output=False),
+    ], max_concurrency=5)
+    assert time.monotonic() - start < 2.5
+    assert results[:3] == [{}, {}, {}]
+    assert results[3] == run_exec("python3", "script_for_dialog_passes.py", 'woot', 7,
+                                  expected_stdio=dialog, echo_output=False)
+    assert results[4]['stdout']['passed']
+
+
 '''
 
 @run_exec(
@@ -0,0 +1,83 @@
+import os
+import time
+
+import pytest
+
+from byu_pytest_utils.dialog import _score_observed_output
+from byu_pytest_utils.score_cache import CACHE_DIR_VARIABLE, ScoreCache
+from conftest import dialog_module, edit_dist_module
+
+EXPECTED = 'Number: ``7;seven;30``\nThe number is 7\n'
+OBSERVED = 'Number: 7\nThe numbr is 8\n'
+
+
+def test_cache_round_trip(tmp_path):
+    cache = ScoreCache(tmp_path / 'cache')
+    key = cache.key('expected', 'observed', None)
+    assert key != cache.key('expected', 'observed', 'tokens')
+    assert cache.get(key) is None
+
+    cache.put(key, {'a': {'score': 0.25, 'passed': False}})
+    assert cache.get(key) == {'a': {'score': 0.25, 'passed': False}}
+    assert not list((tmp_path / 'cache').glob('*.tmp'))
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ScoreCache(tmp_path, max_bytes=2 * len('"value-0"'))
+    cache.put('key-0', 'value-0')
+    cache.put('key-1', 'value-1')
+    now = time.time()
+    os.utime(tmp_path / 'key-0.json', (now - 20, now - 20))
+    os.utime(tmp_path / 'key-1.json', (now - 10, now - 10))
+
+    # Reading key-0 makes key-1 the least recently used
+    assert cache.get('key-0') == 'value-0'
+    cache.put('key-2', 'value-2')
+
+    assert cache.get('key-1') is None
+    assert cache.get('key-0') == 'value-0'
+    assert cache.get('key-2') == 'value-2'
+
+
+def test_cached_scores_skip_alignment(tmp_path, monkeypatch):
+    monkeypatch.setenv(CACHE_DIR_VARIABLE, str(tmp_path))
+    stats = _score_observed_output(EXPECTED, OBSERVED)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the output should not be aligned again')
+
+    monkeypatch.setattr(dialog_module, '_budgeted_alignment', fail)
+    assert _score_observed_output(EXPECTED, OBSERVED) == stats
+
+
+def test_cached_scores_depend_on_the_alignment_settings(tmp_path, monkeypatch):
+    monkeypatch.setenv(CACHE_DIR_VARIABLE, str(tmp_path))
+    _score_observed_output(EXPECTED, OBSERVED)
+    aligned = []
+    budgeted_alignment = dialog_module._budgeted_alignment
+
+    def count(*args, **kwargs):
+        aligned.append(args)
+        return budgeted_alignment(*args, **kwargs)
+
+    monkeypatch.setattr(dialog_module, '_budgeted_alignment', count)
+    monkeypatch.setattr(edit_dist_module, 'ANCHOR_MIN_CELLS', 0)
+    _score_observed_output(EXPECTED, OBSERVED)
+    assert len(aligned) == 1
+
+
+def test_patterns_compared_as_text_are_not_cached(tmp_path, monkeypatch):
+    pytest.importorskip('numpy')
+    monkeypatch.setenv(CACHE_DIR_VARIABLE, str(tmp_path))
+    expected = 'Started at {{re:\\d\\d:\\d\\d}}\n'
+    observed = 'Started at 09:41\n'
+
+    def out_of_time(*args, **kwargs):
+        raise dialog_module.AlignmentTimeout()
+
+    with monkeypatch.context() as patch:
+        patch.setattr(dialog_module, 'pattern_edit_script', out_of_time)
+        stats = _score_observed_output(expected, observed)
+    assert stats[dialog_module.DEFAULT_GROUP_NAME]['alignment'] == 'literal'
+    assert not list(tmp_path.glob('*.json'))
+    assert _score_observed_output(expected, observed)[dialog_module.DEFAULT_GROUP_NAME]['passed']